@@ -18,12 +18,18 @@ class EuroSATClassifier(L.LightningModule):
         wd (float): Weight decay for the optimizer.
         b1 (float): Beta1 parameter for the Adam optimizer.
         b2 (float): Beta2 parameter for the Adam optimizer.
+        cache_kernels (bool): Reuse the patch embedding kernels of the frozen
+        encoder for every set of wavelengths.
     """
 
-    def __init__(self, num_classes, ckpt_path, lr, wd, b1, b2):  # noqa: PLR0913
+    def __init__(  # noqa: PLR0913
+        self, num_classes, ckpt_path, lr, wd, b1, b2, cache_kernels=False
+    ):
         super().__init__()
         self.save_hyperparameters()
-        self.model = Classifier(num_classes=num_classes, ckpt_path=ckpt_path)
+        self.model = Classifier(
+            num_classes=num_classes, ckpt_path=ckpt_path, cache_kernels=cache_kernels
+        )
         self.loss_fn = nn.CrossEntropyLoss()
         self.accuracy = Accuracy(task="multiclass", num_classes=num_classes)
 
@@ -3,6 +3,7 @@ import re
 import torch
 from torch import nn
 
+from src.fsdp import load_checkpoint
 from src.model import Encoder
 
 
@@ -17,7 +18,7 @@ class Classifier(nn.Module):
         device (torch.device): The device to run the model on.
     """
 
-    def __init__(self, num_classes=10, ckpt_path=None):
+    def __init__(self, num_classes=10, ckpt_path=None, cache_kernels=False):
         """
         Initialize the Classifier.
 
@@ -26,6 +27,9 @@ class Classifier(nn.Module):
             classification. Defaults to 10.
             ckpt_path (str, optional): Clay MAE pretrained model checkpoint
             path. Defaults to None.
+            cache_kernels (bool, optional): Reuse the patch embedding kernels
+            of the frozen encoder for every set of wavelengths. Defaults to
+            False.
         """
         super().__init__()
 
@@ -40,6 +44,7 @@ class Classifier(nn.Module):
             heads=12,
             dim_head=64,
             mlp_ratio=4.0,
+            cache_kernels=cache_kernels,
         )
 
         # Simple 2 layer MLP head for classification
@@ -66,7 +71,7 @@ class Classifier(nn.Module):
             ckpt_path (str): Clay MAE pretrained model checkpoint path.
         """
         # Load the checkpoint file
-        ckpt = torch.load(ckpt_path, map_location=self.device)
+        ckpt = load_checkpoint(ckpt_path, map_location=self.device)
         state_dict = ckpt.get("state_dict")
 
         # Remove model.encoder prefix for the clay encoder
@@ -40,14 +40,32 @@ class BioMastersClassifier(L.LightningModule):
         wd (float): Weight decay for the optimizer.
         b1 (float): Beta1 parameter for the Adam optimizer.
         b2 (float): Beta2 parameter for the Adam optimizer.
+        checkpoint_layers (int | list): Stride or indices of the encoder
+        blocks to recompute in the backward pass.
+        cache_kernels (bool): Reuse the patch embedding kernels of the frozen
+        encoder for every set of wavelengths.
     """
 
-    def __init__(self, ckpt_path, feature_maps, lr, wd, b1, b2):  # noqa: PLR0913
+    def __init__(  # noqa: PLR0913
+        self,
+        ckpt_path,
+        feature_maps,
+        lr,
+        wd,
+        b1,
+        b2,
+        checkpoint_layers=None,
+        cache_kernels=False,
+    ):
         super().__init__()
         self.save_hyperparameters()
         # self.model = Classifier(num_classes=1, ckpt_path=ckpt_path)
         self.model = Regressor(
-            num_classes=1, feature_maps=feature_maps, ckpt_path=ckpt_path
+            num_classes=1,
+            feature_maps=feature_maps,
+            ckpt_path=ckpt_path,
+            checkpoint_layers=checkpoint_layers,
+            cache_kernels=cache_kernels,
         )
         self.loss_fn = NoNaNRMSE()
         self.score_fn = MeanSquaredError()
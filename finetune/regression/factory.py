@@ -14,6 +14,7 @@ import torch.nn.functional as F
 from einops import rearrange, repeat
 from torch import nn
 
+from src.fsdp import load_checkpoint
 from src.model import Encoder
 
 
@@ -26,6 +27,10 @@ class SegmentEncoder(Encoder):
         feature_maps (list): Indices of layers to be used for generating
         feature maps.
         ckpt_path (str): Path to the clay checkpoint file.
+        checkpoint_layers (int | list): Stride or indices of the transformer
+        blocks to recompute in the backward pass.
+        cache_kernels (bool): Reuse the patch embedding kernels generated for
+        a set of wavelengths while the encoder is frozen.
     """
 
     def __init__(  # noqa: PLR0913
@@ -40,6 +45,8 @@ class SegmentEncoder(Encoder):
         mlp_ratio,
         feature_maps,
         ckpt_path=None,
+        checkpoint_layers=None,
+        cache_kernels=False,
     ):
         super().__init__(
             mask_ratio,
@@ -50,6 +57,8 @@ class SegmentEncoder(Encoder):
             heads,
             dim_head,
             mlp_ratio,
+            checkpoint_layers=checkpoint_layers,
+            cache_kernels=cache_kernels,
         )
         self.feature_maps = feature_maps
 
@@ -91,7 +100,7 @@ class SegmentEncoder(Encoder):
         """
         if ckpt_path:
             # Load checkpoint
-            ckpt = torch.load(ckpt_path, map_location=self.device)
+            ckpt = load_checkpoint(ckpt_path, map_location=self.device)
             state_dict = ckpt.get("state_dict")
 
             # Prepare new state dict with the desired subset and naming
@@ -147,9 +156,8 @@ class SegmentEncoder(Encoder):
         patches = torch.cat((cls_tokens, patches), dim=1)  # [B (1 + L) D]
 
         features = []
-        for idx, (attn, ff) in enumerate(self.transformer.layers):
-            patches = attn(patches) + patches
-            patches = ff(patches) + patches
+        for idx in range(len(self.transformer.layers)):
+            patches = self.transformer.forward_layer(idx, patches)
             if idx in self.feature_maps:
                 _cube = rearrange(
                     patches[:, 1:, :], "B (H W) D -> B D H W", H=H // 8, W=W // 8
@@ -202,9 +210,20 @@ class Regressor(nn.Module):
         num_classes (int): Number of output classes for segmentation.
         feature_maps (list): Indices of layers to be used for generating feature maps.
         ckpt_path (str): Path to the checkpoint file.
+        checkpoint_layers (int | list): Stride or indices of the encoder
+        blocks to recompute in the backward pass.
+        cache_kernels (bool): Reuse the patch embedding kernels of the frozen
+        encoder for every set of wavelengths.
     """
 
-    def __init__(self, num_classes, feature_maps, ckpt_path):
+    def __init__(  # noqa: PLR0913
+        self,
+        num_classes,
+        feature_maps,
+        ckpt_path,
+        checkpoint_layers=None,
+        cache_kernels=False,
+    ):
         super().__init__()
         # Default values are for the clay mae base model.
         self.encoder = SegmentEncoder(
@@ -218,6 +237,8 @@ class Regressor(nn.Module):
             mlp_ratio=4.0,
             feature_maps=feature_maps,
             ckpt_path=ckpt_path,
+            checkpoint_layers=checkpoint_layers,
+            cache_kernels=cache_kernels,
         )
         self.upsamples = [nn.Upsample(scale_factor=2**i) for i in range(5)]
         self.fusion = FusionBlock(self.encoder.dim, self.encoder.dim // 4)
@@ -34,6 +34,8 @@ class ChesapeakeSegmentor(L.LightningModule):
         wd,
         b1,
         b2,
+        checkpoint_layers=None,
+        cache_kernels=False,
     ):
         super().__init__()
         self.save_hyperparameters()  # Save hyperparameters for checkpointing
@@ -41,6 +43,8 @@ class ChesapeakeSegmentor(L.LightningModule):
             num_classes=num_classes,
             feature_maps=feature_maps,
             ckpt_path=ckpt_path,
+            checkpoint_layers=checkpoint_layers,
+            cache_kernels=cache_kernels,
         )
 
         self.loss_fn = smp.losses.FocalLoss(mode="multiclass")
@@ -0,0 +1,94 @@
+"""
+Benchmark batch_collate against collating through einops, the former
+implementation, in DataLoader workers with random chips.
+
+batch_collate concatenates straight into shared memory in the workers, while
+collating through einops allocates the batch & then copies it into shared
+memory to send it to the main process.
+
+From the project root directory, do:
+
+    python -m scripts.benchmark_collate --batch-size 32 --chips-per-file 8
+"""
+
+import time
+from collections import defaultdict
+
+import click
+import torch
+from einops import rearrange
+from torch.utils.data import DataLoader, Dataset
+
+from src.datamodule import batch_collate
+
+
+class RandomChips(Dataset):
+    def __init__(self, chips_per_file, num_bands, chip_size, length):
+        self.pixels = torch.randn(chips_per_file, num_bands, chip_size, chip_size)
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        return {
+            "pixels": self.pixels.clone(),
+            "time": torch.randn(len(self.pixels), 4),
+            "latlon": torch.randn(len(self.pixels), 4),
+            "platform": "sentinel-2-l2a",
+        }
+
+
+def einops_collate(batch):
+    d = defaultdict(list)
+    for item in batch:
+        for key in ("pixels", "time", "latlon"):
+            d[key].append(item[key])
+        d["platform"].extend([item["platform"]] * len(item["pixels"]))
+    return {
+        "pixels": rearrange(d["pixels"], "b1 b2 c h w -> (b1 b2) c h w"),
+        "time": rearrange(d["time"], "b1 b2 t -> (b1 b2) t"),
+        "latlon": rearrange(d["latlon"], "b1 b2 ll -> (b1 b2) ll"),
+        "platform": d["platform"],
+    }
+
+
+def time_loader(dataset, batch_size, num_workers, collate_fn):
+    """Milliseconds per batch, after the first batch of every worker"""
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=collate_fn,
+        pin_memory=torch.cuda.is_available(),
+    )
+    batches = iter(loader)
+    for _ in range(num_workers):
+        next(batches)
+    start = time.perf_counter()
+    num_batches = sum(1 for _ in batches)
+    return (time.perf_counter() - start) / num_batches * 1000
+
+
+@click.command()
+@click.option("--batch-size", default=32, help="Chip files per batch")
+@click.option("--chips-per-file", default=8)
+@click.option("--num-bands", default=10)
+@click.option("--chip-size", default=224)
+@click.option("--num-batches", default=50)
+@click.option("--num-workers", default=4)
+def main(  # noqa: PLR0913
+    batch_size, chips_per_file, num_bands, chip_size, num_batches, num_workers
+):
+    dataset = RandomChips(
+        chips_per_file, num_bands, chip_size, (num_batches + num_workers) * batch_size
+    )
+    einops_ms = time_loader(dataset, batch_size, num_workers, einops_collate)
+    batch_ms = time_loader(dataset, batch_size, num_workers, batch_collate)
+    print(f"{'einops':>13} {einops_ms:8.1f}ms per batch")
+    print(f"{'batch_collate':>13} {batch_ms:8.1f}ms per batch")
+    print(f"{'speedup':>13} {einops_ms / batch_ms:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
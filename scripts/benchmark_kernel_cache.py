@@ -0,0 +1,81 @@
+"""
+Microbenchmark for the DynamicEmbedding kernel cache.
+
+Times the encoder (conv) & decoder (linear) patch embedding per platform in
+`configs/metadata.yaml`, with & without cached kernels.
+
+From the project root directory, do:
+
+    python -m scripts.benchmark_kernel_cache --batch-size 32 --chip-size 224
+"""
+
+import time
+
+import click
+import torch
+import yaml
+from box import Box
+
+from src.factory import DynamicEmbedding
+
+
+def time_forward(module, batch, waves, steps):
+    for _ in range(3):  # warmup
+        module(batch, waves)
+    if batch.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        module(batch, waves)
+    if batch.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / steps * 1000  # ms per batch
+
+
+@click.command()
+@click.option("--metadata-path", default="configs/metadata.yaml")
+@click.option("--batch-size", default=32)
+@click.option("--chip-size", default=224)
+@click.option("--patch-size", default=8)
+@click.option("--dim", default=768)
+@click.option("--decoder-dim", default=512)
+@click.option("--steps", default=20)
+@click.option("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+def main(  # noqa: PLR0913
+    metadata_path, batch_size, chip_size, patch_size, dim, decoder_dim, steps, device
+):
+    metadata = Box(yaml.safe_load(open(metadata_path)))
+    encoder = DynamicEmbedding(128, 128, patch_size, dim).to(device).eval()
+    decoder = (
+        DynamicEmbedding(128, 128, patch_size, decoder_dim, is_decoder=True)
+        .to(device)
+        .eval()
+    )
+    num_patches = (chip_size // patch_size) ** 2
+
+    print(f"{'platform':<18}{'path':<9}{'uncached':>12}{'cached':>12}{'saved':>12}")
+    with torch.no_grad():
+        for platform, meta in metadata.items():
+            waves = torch.tensor(list(meta.bands.wavelength.values()))
+            inputs = {
+                "encoder": torch.randn(
+                    batch_size, len(waves), chip_size, chip_size, device=device
+                ),
+                "decoder": torch.randn(
+                    batch_size, num_patches, decoder_dim, device=device
+                ),
+            }
+            for path, module in (("encoder", encoder), ("decoder", decoder)):
+                module.cache_kernels = False
+                uncached = time_forward(module, inputs[path], waves, steps)
+                module.cache_kernels = True
+                cached = time_forward(module, inputs[path], waves, steps)
+                module.clear_cache()
+                print(
+                    f"{platform:<18}{path:<9}{uncached:>10.2f}ms{cached:>10.2f}ms"
+                    f"{uncached - cached:>10.2f}ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
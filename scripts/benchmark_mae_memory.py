@@ -0,0 +1,252 @@
+"""
+Measure activation memory of one ClayMAE encoder & decoder training step.
+
+Reports the bytes saved for backward (on any device), the peak memory of the
+step & on a GPU the bytes allocated over the step, for the `clay_mae_base` &
+`clay_mae_large` sizes. Pass `--checkpoint-stride` to trace the
+memory/throughput curve of activation checkpointing, 0 disables it & 1
+recomputes every transformer block.
+
+`--pipeline legacy` runs the masking & decoder input of the model before their
+allocations were trimmed, to compare both with `--pipeline current`.
+
+Peak memory is the peak CUDA memory on a GPU. On CPU it is the peak resident
+memory of the process over the step, above its memory before the step, on
+Linux only, & only tracks tensors when malloc maps them one by one, hence the
+`MALLOC_MMAP_THRESHOLD_` below.
+
+From the project root directory, do:
+
+    MALLOC_MMAP_THRESHOLD_=65536 python -m scripts.benchmark_mae_memory \
+        --batch-size 32 --chip-size 224 --pipeline current --pipeline legacy \
+        --checkpoint-stride 0 --checkpoint-stride 4 --checkpoint-stride 1
+"""
+
+import itertools
+import math
+import re
+import time
+import types
+
+import click
+import torch
+from einops import rearrange, repeat
+
+from src.model import Decoder, Encoder, pos_metadata_tables
+
+MODEL_SIZES = {
+    "base": {
+        "encoder": {"dim": 768, "depth": 12, "heads": 12, "dim_head": 64},
+        "decoder": {"dim": 512, "depth": 6, "heads": 6, "dim_head": 64},
+    },
+    "large": {
+        "encoder": {"dim": 1024, "depth": 24, "heads": 16, "dim_head": 64},
+        "decoder": {"dim": 512, "depth": 8, "heads": 8, "dim_head": 64},
+    },
+}
+
+
+def legacy_mask_out(self, patches):
+    """Encoder.mask_out with the float mask matrix & unused masked gather"""
+    B, L, D = patches.shape
+    if self.shuffle:
+        noise = torch.randn((B, L), device=patches.device)  # [B L]
+    else:
+        noise = rearrange(
+            torch.arange(B * L, device=patches.device), "(B L) -> B L", B=B, L=L
+        )
+    random_indices = torch.argsort(noise, dim=-1)  # [B L]
+    reverse_indices = torch.argsort(random_indices, dim=-1)  # [B L]
+
+    num_masked_patches = int(self.mask_ratio * L)
+    masked_indices, unmasked_indices = (
+        random_indices[:, :num_masked_patches],  # [B mask_ratio * L]
+        random_indices[:, num_masked_patches:],  # [B (1 - mask_ratio) * L]
+    )
+    masked_matrix = torch.zeros((B, L), device=patches.device)  # [B L]
+    masked_matrix[:, :num_masked_patches] = 1
+    masked_matrix = torch.gather(masked_matrix, dim=1, index=reverse_indices)
+
+    batch_indices = rearrange(torch.arange(B, device=patches.device), "B -> B 1")
+    unmasked_patches = patches[batch_indices, unmasked_indices, :]
+    _ = patches[batch_indices, masked_indices, :]  # [B L:mask_ratio D]
+    return unmasked_patches, unmasked_indices, masked_indices, masked_matrix
+
+
+def legacy_reconstruct_and_add_encoding(  # noqa: PLR0913
+    self,
+    unmasked_patches,
+    unmasked_indices,
+    masked_indices,
+    masked_matrix,
+    time,
+    latlon,
+    gsd,
+):
+    """Decoder input built in a zero [B L D] buffer with two scatters"""
+    B, L = masked_matrix.shape
+    cls_tokens, unmasked_patches = unmasked_patches[:, :1], unmasked_patches[:, 1:]
+    pos_encoding, time_latlon = pos_metadata_tables(
+        int(math.sqrt(L)), self.dim, gsd, time, latlon, unmasked_patches.device
+    )
+    pos_encoding = pos_encoding.expand(B, L, -1)  # [B L D]
+    batch_indices = rearrange(
+        torch.arange(B, device=unmasked_patches.device), "B -> B 1"
+    )
+
+    num_masked_patches = int(self.mask_ratio * L)
+    masked_patches = repeat(self.mask_patch, "D -> B L D", B=B, L=num_masked_patches)
+    masked_patches = masked_patches + (
+        pos_encoding[batch_indices, masked_indices, :] + time_latlon
+    )  # [B L:mask_ratio D]
+    unmasked_patches = unmasked_patches + (
+        pos_encoding[batch_indices, unmasked_indices, :] + time_latlon
+    )  # [B L:(1 - mask_ratio) D]
+
+    decoder_patches = torch.zeros(
+        (B, L, self.dim), device=unmasked_patches.device
+    )  # [B L D]
+    decoder_patches[batch_indices, unmasked_indices, :] = unmasked_patches
+    decoder_patches[batch_indices, masked_indices, :] = masked_patches
+    return torch.cat((cls_tokens, decoder_patches), dim=1)  # [B (1 + L) D]
+
+
+def build(model_size, patch_size, device, checkpoint_stride=0, pipeline="current"):
+    sizes = MODEL_SIZES[model_size]
+    encoder = Encoder(
+        mask_ratio=0.75,
+        patch_size=patch_size,
+        shuffle=True,
+        mlp_ratio=4,
+        checkpoint_layers=checkpoint_stride,
+        **sizes["encoder"],
+    )
+    decoder = Decoder(
+        mask_ratio=0.75,
+        patch_size=patch_size,
+        encoder_dim=sizes["encoder"]["dim"],
+        mlp_ratio=4,
+        checkpoint_layers=checkpoint_stride,
+        **sizes["decoder"],
+    )
+    if pipeline == "legacy":
+        encoder.mask_out = types.MethodType(legacy_mask_out, encoder)
+        decoder.reconstruct_and_add_encoding = types.MethodType(
+            legacy_reconstruct_and_add_encoding, decoder
+        )
+    return encoder.to(device), decoder.to(device)
+
+
+def memory_status(key):
+    """Memory of the process from /proc, in bytes"""
+    with open("/proc/self/status") as f:
+        return int(re.search(rf"{key}:\s+(\d+) kB", f.read()).group(1)) * 1024
+
+
+def reset_cpu_peak():
+    """Reset the peak resident memory of the process, None if not on Linux"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return memory_status("VmRSS")
+    except OSError:
+        return None
+
+
+def step(encoder, decoder, datacube):
+    """Run forward & backward, return the activation bytes saved for backward"""
+    params = {
+        param.data_ptr()
+        for module in (encoder, decoder)
+        for param in module.parameters()
+    }
+    saved = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in params:
+            saved[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        (
+            encoded_unmasked_patches,
+            unmasked_indices,
+            masked_indices,
+            masked_matrix,
+        ) = encoder(datacube)
+        pixels, _ = decoder(
+            encoded_unmasked_patches,
+            unmasked_indices,
+            masked_indices,
+            masked_matrix,
+            datacube["time"],
+            datacube["latlon"],
+            datacube["gsd"],
+            datacube["waves"],
+        )
+    pixels.mean().backward()
+    return sum(saved.values())
+
+
+@click.command()
+@click.option("--model-size", type=click.Choice(MODEL_SIZES), multiple=True)
+@click.option("--batch-size", default=32)
+@click.option("--chip-size", default=224)
+@click.option("--patch-size", default=8)
+@click.option("--checkpoint-stride", type=int, multiple=True)
+@click.option("--pipeline", type=click.Choice(["current", "legacy"]), multiple=True)
+@click.option("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+def main(  # noqa: PLR0913
+    model_size, batch_size, chip_size, patch_size, checkpoint_stride, pipeline, device
+):
+    datacube = {
+        "pixels": torch.randn(batch_size, 4, chip_size, chip_size, device=device),
+        "time": torch.randn(batch_size, 4, device=device),
+        "latlon": torch.randn(batch_size, 4, device=device),
+        "gsd": torch.tensor(10.0),
+        "waves": torch.tensor([0.493, 0.56, 0.665, 0.842]),
+    }
+
+    print(
+        f"{'model':<8}{'pipeline':>10}{'stride':>8}{'saved for backward':>20}"
+        f"{'peak memory':>16}{'allocated':>16}{'step':>12}"
+    )
+    for size, name, stride in itertools.product(
+        model_size or MODEL_SIZES,
+        pipeline or ("current", "legacy"),
+        checkpoint_stride or (0,),
+    ):
+        encoder, decoder = build(size, patch_size, device, stride, name)
+        step(encoder, decoder, datacube)  # warmup
+        for module in (encoder, decoder):
+            module.zero_grad(set_to_none=True)
+        allocated = "n/a"
+        if device == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            start_allocated = torch.cuda.memory_stats()["allocated_bytes.all.allocated"]
+        else:
+            start_rss = reset_cpu_peak()
+
+        start = time.perf_counter()
+        saved = step(encoder, decoder, datacube)
+        if device == "cuda":
+            torch.cuda.synchronize()
+            peak = f"{torch.cuda.max_memory_allocated() / 2**20:.0f} MiB"
+            allocated = torch.cuda.memory_stats()["allocated_bytes.all.allocated"]
+            allocated = f"{(allocated - start_allocated) / 2**20:.0f} MiB"
+        elif start_rss is not None:
+            peak = f"{(memory_status('VmHWM') - start_rss) / 2**20:.0f} MiB"
+        else:
+            peak = "n/a"
+        elapsed = (time.perf_counter() - start) * 1000
+        print(
+            f"{size:<8}{name:>10}{stride:>8}{saved / 2**20:>16.0f} MiB"
+            f"{peak:>16}{allocated:>16}{elapsed:>10.0f}ms"
+        )
+        del encoder, decoder
+
+
+if __name__ == "__main__":
+    main()
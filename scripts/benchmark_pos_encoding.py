@@ -0,0 +1,85 @@
+"""
+Benchmark step time & peak memory of the ClayMAE encoder & decoder for
+several chip sizes, with the memoized positional/GSD encoding tables.
+
+Pass `--no-cache` to clear the tables before every step, which measures the
+cost of rebuilding them.
+
+From the project root directory, do:
+
+    python -m scripts.benchmark_pos_encoding --batch-size 32
+"""
+
+import time
+
+import click
+import torch
+
+from src.model import Decoder, Encoder
+from src.utils import cached_posemb_sincos_2d_with_gsd
+
+CHIP_SIZES = (64, 128, 224, 256)
+
+
+def step(encoder, decoder, datacube):
+    (
+        encoded_unmasked_patches,
+        unmasked_indices,
+        masked_indices,
+        masked_matrix,
+    ) = encoder(datacube)
+    pixels, _ = decoder(
+        encoded_unmasked_patches,
+        unmasked_indices,
+        masked_indices,
+        masked_matrix,
+        datacube["time"],
+        datacube["latlon"],
+        datacube["gsd"],
+        datacube["waves"],
+    )
+    pixels.mean().backward()
+
+
+@click.command()
+@click.option("--batch-size", default=32)
+@click.option("--patch-size", default=8)
+@click.option("--steps", default=10)
+@click.option("--no-cache", is_flag=True)
+@click.option("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+def main(batch_size, patch_size, steps, no_cache, device):
+    encoder = Encoder(0.75, patch_size, True, 768, 12, 12, 64, 4).to(device)
+    decoder = Decoder(0.75, patch_size, 768, 512, 6, 6, 64, 4).to(device)
+    waves = torch.tensor([0.493, 0.56, 0.665, 0.842])
+    gsd = torch.tensor(10.0)
+
+    print(f"{'chip':<8}{'step time':>12}{'peak memory':>16}")
+    for chip_size in CHIP_SIZES:
+        datacube = {
+            "pixels": torch.randn(batch_size, 4, chip_size, chip_size, device=device),
+            "time": torch.randn(batch_size, 4, device=device),
+            "latlon": torch.randn(batch_size, 4, device=device),
+            "gsd": gsd,
+            "waves": waves,
+        }
+        step(encoder, decoder, datacube)  # warmup
+        if device == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+
+        start = time.perf_counter()
+        for _ in range(steps):
+            if no_cache:
+                cached_posemb_sincos_2d_with_gsd.cache_clear()
+            step(encoder, decoder, datacube)
+        if device == "cuda":
+            torch.cuda.synchronize()
+            peak = f"{torch.cuda.max_memory_allocated() / 2**20:.0f} MiB"
+        else:
+            peak = "n/a"
+        elapsed = (time.perf_counter() - start) / steps * 1000
+        print(f"{chip_size:<8}{elapsed:>10.1f}ms{peak:>16}")
+
+
+if __name__ == "__main__":
+    main()
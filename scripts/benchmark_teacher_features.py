@@ -0,0 +1,91 @@
+"""
+Benchmark ClayMAE training steps with the teacher forward against precomputed
+teacher features, for every platform in `configs/metadata.yaml`.
+
+From the project root directory, do:
+
+    python -m scripts.benchmark_teacher_features --model-size base --batch-size 32
+"""
+
+import time
+
+import click
+import torch
+import yaml
+from box import Box
+
+from src.model import clay_mae_base, clay_mae_large, clay_mae_small, clay_mae_tiny
+
+MODEL_SIZES = {
+    "tiny": clay_mae_tiny,
+    "small": clay_mae_small,
+    "base": clay_mae_base,
+    "large": clay_mae_large,
+}
+
+
+def time_step(model, datacube, steps):
+    """Milliseconds per forward & backward pass"""
+    for _ in range(2):  # warmup
+        model(datacube)[0].backward()
+    if datacube["time"].is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        model(datacube)[0].backward()
+    if datacube["time"].is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / steps * 1000
+
+
+@click.command()
+@click.option("--metadata-path", default="configs/metadata.yaml")
+@click.option("--model-size", type=click.Choice(MODEL_SIZES), default="base")
+@click.option("--teacher", default="vit_base_patch16_224.dino")
+@click.option("--batch-size", default=32)
+@click.option("--chip-size", default=224)
+@click.option("--patch-size", default=8)
+@click.option("--steps", default=10)
+@click.option("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+def main(  # noqa: PLR0913
+    metadata_path, model_size, teacher, batch_size, chip_size, patch_size, steps, device
+):
+    metadata = Box(yaml.safe_load(open(metadata_path)))
+    model = MODEL_SIZES[model_size](
+        mask_ratio=0.75,
+        patch_size=patch_size,
+        norm_pix_loss=False,
+        shuffle=True,
+        metadata=metadata,
+        teacher=teacher,
+    ).to(device)
+    model.teacher.eval()
+
+    print(
+        f"{'platform':<18}{'teacher':>12}{'features':>12}"
+        f"{'chips/s':>10}{'chips/s':>10}{'gain':>8}"
+    )
+    for platform, meta in metadata.items():
+        datacube = {
+            "pixels": torch.randn(
+                batch_size, len(meta.band_order), chip_size, chip_size, device=device
+            ),
+            "time": torch.randn(batch_size, 4, device=device),
+            "latlon": torch.randn(batch_size, 4, device=device),
+            "platform": [platform] * batch_size,
+        }
+        with_teacher = time_step(model, datacube, steps)
+        datacube["teacher_features"] = torch.randn(
+            batch_size, model.teacher.num_features, device=device
+        )
+        with_features = time_step(model, datacube, steps)
+        print(
+            f"{platform:<18}{with_teacher:>10.1f}ms{with_features:>10.1f}ms"
+            f"{batch_size / with_teacher * 1000:>10.1f}"
+            f"{batch_size / with_features * 1000:>10.1f}"
+            f"{with_teacher / with_features:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Build the manifest of the npz chips of a data directory, for ClayDataModule
+with `data.manifest_path`. When the manifest already exists, it is updated:
+only new or changed chips are read & removed chips are dropped.
+
+From the project root directory, do:
+
+    python -m scripts.build_manifest --data-dir data --manifest-path manifest.npz
+"""
+
+from pathlib import Path
+
+import click
+import numpy as np
+
+from src.manifest import ChipManifest, build_manifest
+
+
+@click.command()
+@click.option("--data-dir", default="data")
+@click.option("--manifest-path", default="manifest.npz")
+@click.option("--workers", default=8)
+def main(data_dir, manifest_path, workers):
+    previous = None
+    if Path(manifest_path).exists():
+        previous = ChipManifest.load(manifest_path, data_dir)
+    manifest = build_manifest(data_dir, previous=previous, workers=workers)
+    manifest.save(manifest_path)
+
+    print(f"Total number of chips: {len(manifest)}")
+    for platform, indices in manifest.platform_indices(manifest.platforms).items():
+        print(f"{platform:20} {len(indices):>10} chips")
+    if previous is not None:
+        print(f"Previous manifest: {len(previous)} chips")
+    print(f"Total size: {np.sum(manifest.columns['nbytes']) / 1024**3:.1f} GB")
+
+
+if __name__ == "__main__":
+    main()
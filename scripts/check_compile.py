@@ -0,0 +1,82 @@
+"""
+Check that the compiled ClayMAE encoder & decoder run without graph breaks and
+without recompiling when the chip size or the platform changes.
+
+Runs a small model on CPU through several chip sizes & band counts, then
+reports the graph breaks & the number of compiled graphs from the dynamo
+counters. Exits with an error if any graph break was found or if the frames
+were compiled more often than `--max-graphs`.
+
+Defaults to the `aot_eager` backend, which checks the model code itself & is
+quick on CPU. Pass `--backend inductor` to include code generation, which can
+add backend specific guards, e.g. the CPU kernels recompile once a reduction
+grows past 4096 elements.
+
+From the project root directory, do:
+
+    python -m scripts.check_compile --chip-size 64 --chip-size 128 --chip-size 256
+"""
+
+import itertools
+
+import click
+import torch
+from torch._dynamo.utils import counters
+
+from src.model import Decoder, Encoder
+
+WAVES = {
+    "sentinel-2-l2a": [0.493, 0.56, 0.665, 0.704, 0.74, 0.783, 0.842, 0.865],
+    "naip": [0.65, 0.56, 0.48, 0.842],
+}
+
+
+@click.command()
+@click.option("--batch-size", default=6)
+@click.option("--chip-size", type=int, multiple=True)
+@click.option("--patch-size", default=8)
+@click.option("--backend", default="aot_eager")
+@click.option("--max-graphs", default=2)
+def main(batch_size, chip_size, patch_size, backend, max_graphs):  # noqa: PLR0913
+    torch._dynamo.reset()
+    counters.clear()
+    # Dimensions that don't collide with the number of patches, dynamo would
+    # otherwise specialize on them.
+    encoder = Encoder(0.75, patch_size, True, 96, 2, 4, 16, 2)
+    decoder = Decoder(0.75, patch_size, 96, 48, 1, 2, 16, 2)
+    # Same as ClayMAE.compile_modules
+    encoder.forward = torch.compile(encoder.forward, backend=backend, dynamic=True)
+    decoder.forward = torch.compile(decoder.forward, backend=backend, dynamic=True)
+
+    for size, waves in itertools.product(chip_size or (64, 128, 256), WAVES.values()):
+        datacube = {
+            "pixels": torch.randn(batch_size, len(waves), size, size),
+            "time": torch.randn(batch_size, 4),
+            "latlon": torch.randn(batch_size, 4),
+            "gsd": torch.tensor(10.0),
+            "waves": torch.tensor(waves),
+        }
+        encoded, unmasked_idx, masked_idx, masked_matrix = encoder(datacube)
+        pixels, _ = decoder(
+            encoded,
+            unmasked_idx,
+            masked_idx,
+            masked_matrix,
+            datacube["time"],
+            datacube["latlon"],
+            datacube["gsd"],
+            datacube["waves"],
+        )
+        pixels.mean().backward()
+
+    graph_breaks = sum(counters["graph_break"].values())
+    graphs = counters["stats"]["unique_graphs"]
+    for reason, count in counters["graph_break"].items():
+        print(f"graph break ({count}x): {reason}")
+    print(f"graph breaks: {graph_breaks}, compiled graphs: {graphs}")
+    if graph_breaks or graphs > max_graphs:
+        raise click.ClickException("ClayMAE is not graph-break & recompile free")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Check ClayFSDPStrategy end to end on CPU with the gloo backend.
+
+Trains a small ClayMAEModule for a few steps on random chips across several
+processes, checks there is one FSDP unit per transformer block plus the teacher
+& the root, saves a sharded checkpoint & consolidates it with `load_checkpoint`
+into the same state_dict keys & shapes as an unwrapped ClayMAEModule, which is
+what the finetune factories read.
+
+From the project root directory, do:
+
+    python -m scripts.check_fsdp --devices 2 --ckpt-path checkpoints/fsdp-check
+"""
+
+import click
+import lightning as L
+import torch
+from torch.distributed.fsdp import FullyShardedDataParallel
+from torch.utils.data import DataLoader, Dataset
+
+from src.fsdp import ClayFSDPStrategy, load_checkpoint
+from src.model import ClayMAEModule
+from src.transformer import TransformerBlock
+
+
+class RandomChips(Dataset):
+    def __init__(self, platform, num_bands, chip_size, length):
+        self.platform = platform
+        self.num_bands = num_bands
+        self.chip_size = chip_size
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        return {
+            "pixels": torch.randn(self.num_bands, self.chip_size, self.chip_size),
+            "time": torch.randn(4),
+            "latlon": torch.randn(4),
+            "platform": self.platform,
+        }
+
+
+@click.command()
+@click.option("--devices", default=2)
+@click.option("--steps", default=4)
+@click.option("--batch-size", default=4)
+@click.option("--chip-size", default=64)
+@click.option("--teacher", default="vit_base_patch16_224.dino")
+@click.option("--ckpt-path", default="checkpoints/fsdp-check")
+def main(devices, steps, batch_size, chip_size, teacher, ckpt_path):  # noqa: PLR0913
+    model_args = {
+        "model_size": "tiny",
+        "metadata_path": "configs/metadata.yaml",
+        "teacher": teacher,
+    }
+    module = ClayMAEModule(**model_args)
+    dataset = RandomChips("sentinel-2-l2a", 10, chip_size, steps * batch_size)
+    trainer = L.Trainer(
+        accelerator="cpu",
+        devices=devices,
+        strategy=ClayFSDPStrategy(process_group_backend="gloo"),
+        max_steps=steps,
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+    )
+    trainer.fit(module, DataLoader(dataset, batch_size=batch_size))
+    units = [
+        unit
+        for unit in trainer.strategy.model.modules()
+        if isinstance(unit, FullyShardedDataParallel)
+    ]
+    blocks = [
+        block for block in module.modules() if isinstance(block, TransformerBlock)
+    ]
+    assert len(units) == len(blocks) + 2, f"Expected {len(blocks) + 2} FSDP units"
+    trainer.save_checkpoint(ckpt_path)
+
+    if trainer.is_global_zero:
+        state_dict = load_checkpoint(ckpt_path)["state_dict"]
+        expected = ClayMAEModule(**model_args).state_dict()
+        assert state_dict.keys() == expected.keys(), "Consolidated keys differ"
+        for name, param in expected.items():
+            assert state_dict[name].shape == param.shape, f"{name} shape differs"
+        print(f"Consolidated {len(state_dict)} tensors from {ckpt_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Check that ClaySampler & BudgetedClaySampler skip the platforms without chips
+on one side of the train/val split of ClayDataModule.
+
+Splits the paths of `--chips` chips of a large platform & `--small-chips`
+chips of a small one with every seed in `range(--seeds)`, no files are read.
+Every sampler of both sides, with & without `mix_platforms`, must give as
+many batches as its length, of chips of its side only. Exits with an error
+if they do not, or if no seed left the small platform without chips on a
+side, to raise `--seeds`.
+
+From the project root directory, do:
+
+    python -m scripts.check_sampler --small-chips 7 --seeds 20
+"""
+
+from pathlib import PurePosixPath
+from types import SimpleNamespace
+
+import click
+
+from src.datamodule import BudgetedClaySampler, ClayDataModule, ClaySampler
+
+
+def check(sampler, num_chips):
+    """Batches of a sampler over an epoch, against its length & its chips"""
+    batches = list(sampler)
+    if len(batches) != len(sampler):
+        raise click.ClickException(
+            f"{type(sampler).__name__} gave {len(batches)} batches "
+            f"instead of {len(sampler)}"
+        )
+    for batch in batches:
+        if len(batch) != sampler.batch_size or not all(
+            0 <= idx < num_chips for idx in batch
+        ):
+            raise click.ClickException(f"Invalid batch {batch}")
+
+
+@click.command()
+@click.option("--platform", default="naip")
+@click.option("--chips", default=40)
+@click.option("--small-platform", default="linz")
+@click.option("--small-chips", default=7)
+@click.option("--seeds", default=20)
+@click.option("--batch-size", default=4)
+@click.option("--samples-per-epoch", default=64)
+def main(  # noqa: PLR0913
+    platform, chips, small_platform, small_chips, seeds, batch_size, samples_per_epoch
+):
+    platforms = [platform, small_platform]
+    chips_path = [
+        PurePosixPath(f"data/{name}/chip_{i:04d}.npz")
+        for name, count in ((platform, chips), (small_platform, small_chips))
+        for i in range(count)
+    ]
+    skipped = 0
+    for seed in range(seeds):
+        datamodule = ClayDataModule(platforms=platforms, seed=seed)
+        for side in datamodule.split_chips(chips_path):
+            dataset = SimpleNamespace(chips_path=side)
+            for mix_platforms in (False, True):
+                sampler = ClaySampler(
+                    dataset, platforms, batch_size, mix_platforms, seed=seed
+                )
+                check(sampler, len(side))
+                check(
+                    BudgetedClaySampler(
+                        dataset,
+                        platforms,
+                        batch_size,
+                        samples_per_epoch,
+                        mix_platforms=mix_platforms,
+                        seed=seed,
+                    ),
+                    len(side),
+                )
+            skipped += small_platform not in sampler.platforms
+    print(f"{small_platform} had no chips on {skipped} of {2 * seeds} split sides")
+    if skipped == 0:
+        raise click.ClickException("No split left a side empty, raise --seeds")
+
+
+if __name__ == "__main__":
+    main()
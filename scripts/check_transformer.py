@@ -0,0 +1,85 @@
+"""
+Check that the fused-attention Transformer of `src/transformer.py` matches the
+`vit_pytorch.simple_vit.Transformer` it replaces, on CPU.
+
+Loads the state_dict of a randomly initialized simple_vit Transformer into
+`src.transformer.Transformer` for every attention backend, with & without
+activation checkpointing, then compares the outputs, the gradients of the
+input & the gradients of the weights. Exits with an error if any of them
+differ by more than `--atol`.
+
+From the project root directory, do:
+
+    python -m scripts.check_transformer --atol 1e-5
+"""
+
+import click
+import torch
+from vit_pytorch.simple_vit import Transformer as SimpleViTTransformer
+
+from src.transformer import ATTENTION_BACKENDS, Transformer
+
+
+def forward_backward(model, x):
+    """Output, input gradient & weight gradients of a forward & backward"""
+    x = x.clone().requires_grad_()
+    out = model(x)
+    out.square().mean().backward()
+    grads = {name: param.grad for name, param in model.named_parameters()}
+    return out.detach(), x.grad, grads
+
+
+@click.command()
+@click.option("--batch-size", default=4)
+@click.option("--tokens", default=65, help="Class token & 8x8 patches")
+@click.option("--dim", default=96)
+@click.option("--depth", default=3)
+@click.option("--heads", default=4)
+@click.option("--dim-head", default=24)
+@click.option("--mlp-dim", default=192)
+@click.option("--atol", default=1e-5)
+def main(  # noqa: PLR0913
+    batch_size, tokens, dim, depth, heads, dim_head, mlp_dim, atol
+):
+    torch.manual_seed(0)
+    reference = SimpleViTTransformer(dim, depth, heads, dim_head, mlp_dim)
+    x = torch.randn(batch_size, tokens, dim)
+    expected_out, expected_x_grad, expected_grads = forward_backward(reference, x)
+
+    failed = False
+    print(
+        f"{'backend':<12}{'checkpoint':>12}"
+        f"{'output':>12}{'input grad':>12}{'weights':>12}"
+    )
+    for backend in ATTENTION_BACKENDS:
+        for checkpoint_layers in (None, 1):
+            model = Transformer(
+                dim,
+                depth,
+                heads,
+                dim_head,
+                mlp_dim,
+                attention_backend=backend,
+                checkpoint_layers=checkpoint_layers,
+            )
+            model.load_state_dict(reference.state_dict())
+            out, x_grad, grads = forward_backward(model, x)
+            errors = (
+                (out - expected_out).abs().max().item(),
+                (x_grad - expected_x_grad).abs().max().item(),
+                max(
+                    (grad - expected_grads[name]).abs().max().item()
+                    for name, grad in grads.items()
+                ),
+            )
+            failed |= max(errors) > atol
+            print(
+                f"{backend:<12}{str(checkpoint_layers):>12}"
+                + "".join(f"{error:>12.2e}" for error in errors)
+            )
+    if failed:
+        raise click.ClickException(f"Differences above {atol} with simple_vit")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Compute the exact per-band mean & std of the chips of every platform & write
+them into the `bands` of `configs/metadata.yaml`, see `src/bandstats.py`.
+
+Chips are listed from the manifest of `--manifest-path` when given, else by
+building one. Pixels equal to a `--nodata` value or not finite are left out.
+Bands are named after the existing `bands.mean` of a platform, or `band_<i>`
+for a platform new to the metadata file, whose other keys are to be filled in
+by hand.
+
+With `--bins`, a second pass over the chips computes histograms over the
+range of every band, saved to `--histogram-path`, and the `--percentiles` of
+every band are written into `bands.percentiles` too.
+
+From the project root directory, do:
+
+    python -m scripts.compute_band_stats --data-dir data \\
+        --manifest-path manifest.npz --nodata 0 --nodata -9999
+"""
+
+import click
+import numpy as np
+import yaml
+
+from src.bandstats import compute_band_stats, histogram_edges
+from src.manifest import ChipManifest, build_manifest
+
+
+class MetadataDumper(yaml.SafeDumper):
+    """Indent lists & write whole floats as `1105.`, like the metadata file"""
+
+    def increase_indent(self, flow=False, indentless=False):  # noqa: ARG002
+        return super().increase_indent(flow, False)
+
+    def represent_float(self, data):
+        if data.is_integer():
+            return self.represent_scalar("tag:yaml.org,2002:float", f"{data:.0f}.")
+        return super().represent_float(data)
+
+
+MetadataDumper.add_representer(float, MetadataDumper.represent_float)
+
+
+def band_values(names, values):
+    return {name: float(f"{value:.6g}") for name, value in zip(names, values)}
+
+
+@click.command()
+@click.option("--data-dir", default="data")
+@click.option("--manifest-path", default=None, help="Built when not given")
+@click.option("--metadata-path", default="configs/metadata.yaml")
+@click.option("--output-path", default=None, help="Defaults to --metadata-path")
+@click.option("--platforms", default=None, help="Comma separated, defaults to all")
+@click.option("--nodata", multiple=True, type=float, help="Fill values to skip")
+@click.option("--bins", default=0, help="Histogram bins per band, 0 to skip")
+@click.option("--percentiles", default="1,2,50,98,99")
+@click.option("--histogram-path", default="band_histograms.npz")
+@click.option("--chunk-size", default=256, help="Chips per job")
+@click.option("--workers", default=8)
+def main(  # noqa: PLR0913
+    data_dir,
+    manifest_path,
+    metadata_path,
+    output_path,
+    platforms,
+    nodata,
+    bins,
+    percentiles,
+    histogram_path,
+    chunk_size,
+    workers,
+):
+    if manifest_path is None:
+        manifest = build_manifest(data_dir, workers=workers)
+    else:
+        manifest = ChipManifest.load(manifest_path, data_dir)
+    platforms = platforms.split(",") if platforms else list(manifest.platforms)
+    with open(metadata_path) as f:
+        metadata = yaml.safe_load(f)
+
+    kwargs = {"nodata": nodata, "workers": workers, "chunk_size": chunk_size}
+    moments = compute_band_stats(manifest, platforms, **kwargs)
+    histograms = {}
+    if bins:
+        edges = {
+            platform: histogram_edges(stats, bins)
+            for platform, stats in moments.items()
+        }
+        histograms = compute_band_stats(manifest, platforms, edges=edges, **kwargs)
+        np.savez(
+            histogram_path,
+            **{f"{platform}/edges": edges[platform] for platform in histograms},
+            **{f"{p}/counts": stats.counts for p, stats in histograms.items()},
+        )
+
+    for platform, stats in moments.items():
+        bands = metadata.setdefault(platform, {}).setdefault("bands", {})
+        names = list(bands.get("mean", {})) or [
+            f"band_{i}" for i in range(len(stats.count))
+        ]
+        if len(names) != len(stats.count):
+            raise click.ClickException(
+                f"{platform} chips have {len(stats.count)} bands, "
+                f"the metadata has {len(names)}"
+            )
+        bands["mean"] = band_values(names, stats.mean)
+        bands["std"] = band_values(names, stats.std)
+        if platform in histograms:
+            q = [float(p) for p in percentiles.split(",")]
+            values = histograms[platform].percentiles(q)  # [C len(q)]
+            bands["percentiles"] = {
+                f"p{p:g}": band_values(names, values[:, i]) for i, p in enumerate(q)
+            }
+
+        print(f"{platform}: {stats.count.max()} pixels per band")
+        for name, mean, std, low, high in zip(
+            names, stats.mean, stats.std, stats.min, stats.max
+        ):
+            print(f"  {name:12} {mean:>12.4f} {std:>12.4f} [{low:g}, {high:g}]")
+
+    with open(output_path or metadata_path, "w") as f:
+        yaml.dump(metadata, f, Dumper=MetadataDumper, sort_keys=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compute the quality index of the chips of a manifest, see `src/quality.py`,
+and save it as extra columns of the manifest, for ClayDataModule with
+`data.chip_filters`.
+
+Only the chips without quality yet are read, e.g. those added by
+`scripts/build_manifest.py` since the last run, unless `--recompute`.
+Saturation values are given per platform, as `<platform>=<value>`.
+
+From the project root directory, do:
+
+    python -m scripts.compute_chip_quality --data-dir data \\
+        --manifest-path manifest.npz --nodata 0 --nodata -9999 \\
+        --saturation sentinel-2-l2a=10000 --saturation naip=255
+
+Then keep the chips within `[low, high]` bounds of the columns, `null` for
+no bound, in the config. Filters keeping no chip of a platform are an error:
+
+    data:
+      manifest_path: manifest.npz
+      chip_filters:
+        nodata_fraction: [null, 0.2]
+        saturated_fraction: [null, 0.5]
+        variance: [1.0, null]
+"""
+
+import click
+import numpy as np
+
+from src.manifest import ChipManifest
+from src.quality import QUALITY_COLUMNS, compute_quality
+
+
+@click.command()
+@click.option("--data-dir", default="data")
+@click.option("--manifest-path", default="manifest.npz")
+@click.option("--nodata", multiple=True, type=float, help="Fill values")
+@click.option("--saturation", multiple=True, help="<platform>=<value>")
+@click.option("--recompute", is_flag=True, help="Read all chips again")
+@click.option("--chunk-size", default=256, help="Chips per job")
+@click.option("--workers", default=8)
+def main(  # noqa: PLR0913
+    data_dir, manifest_path, nodata, saturation, recompute, chunk_size, workers
+):
+    manifest = ChipManifest.load(manifest_path, data_dir)
+    saturation = {
+        platform: float(value)
+        for platform, value in (item.split("=") for item in saturation)
+    }
+
+    for column in QUALITY_COLUMNS:
+        if recompute or column not in manifest.columns:
+            manifest.columns[column] = np.full(len(manifest), np.nan, np.float32)
+    missing = np.zeros(len(manifest), dtype=bool)
+    for column in QUALITY_COLUMNS:
+        missing |= np.isnan(manifest.columns[column])
+    rows = np.flatnonzero(missing)
+    print(f"Reading {len(rows)} of {len(manifest)} chips")
+
+    quality = compute_quality(
+        manifest, rows, nodata, saturation, workers=workers, chunk_size=chunk_size
+    )
+    for column, values in quality.items():
+        manifest.columns[column][rows] = values
+    manifest.save(manifest_path)
+
+    for platform, indices in manifest.platform_indices(manifest.platforms).items():
+        print(f"{platform}: {len(indices)} chips, percentiles 1 / 50 / 99")
+        for column in QUALITY_COLUMNS:
+            low, median, high = np.percentile(
+                manifest.columns[column][indices], (1, 50, 99)
+            )
+            print(f"  {column:20} {low:>12.4g} {median:>12.4g} {high:>12.4g}")
+
+
+if __name__ == "__main__":
+    main()
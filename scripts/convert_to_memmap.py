@@ -0,0 +1,102 @@
+"""
+Convert a directory of npz chip files into the memory-mapped store read by
+ClayDataModule with `data.data_format: memmap`.
+
+Every platform gets a directory `<output-dir>/<platform>` with the
+uncompressed pixels of all its chips in `pixels.npy` [N b2 C H W], in the
+dtype of the chip files, the `week_norm`, `hour_norm`, `lat_norm` & `lon_norm`
+metadata in one [N b2 2] array each & the chip names in `names.npy`. All chips
+of a platform must have the same shape. Chips are written in parallel, into
+disjoint rows of the arrays.
+
+With `--tile-size`, the pixels are stored as square tiles [N b2 C nH nW t t],
+so that crops smaller than the chips only read the tiles they cover. Pick a
+tile size that divides the chip size, 32 float32 tiles are one 4 KiB page.
+
+From the project root directory, do:
+
+    python -m scripts.convert_to_memmap --data-dir data --output-dir memmap
+"""
+
+from collections import defaultdict
+from multiprocessing import Pool
+from pathlib import Path
+
+import click
+import numpy as np
+from einops import rearrange
+
+from src.datamodule import CHIP_COLUMNS
+
+
+def tile(pixels, tile_size):
+    """Split pixels [... H W] into tiles [... nH nW t t]"""
+    if not tile_size:
+        return pixels
+    return rearrange(
+        pixels, "... (nh th) (nw tw) -> ... nh nw th tw", th=tile_size, tw=tile_size
+    )
+
+
+def write_chips(job):
+    store_path, start, chips_path, tile_size = job
+    arrays = {
+        key: np.load(store_path / f"{key}.npy", mmap_mode="r+")
+        for key in ("pixels", *CHIP_COLUMNS)
+    }
+    for row, chip_path in enumerate(chips_path, start=start):
+        with np.load(chip_path, allow_pickle=False) as chip:
+            for key, array in arrays.items():
+                array[row] = (
+                    tile(chip[key], tile_size) if key == "pixels" else chip[key]
+                )
+    for array in arrays.values():
+        array.flush()
+    return len(chips_path)
+
+
+@click.command()
+@click.option("--data-dir", default="data")
+@click.option("--output-dir", default="memmap")
+@click.option("--tile-size", default=0, help="Side of the pixel tiles, 0 to not tile")
+@click.option("--chunk-size", default=256, help="Chips written per job")
+@click.option("--workers", default=8)
+def main(data_dir, output_dir, tile_size, chunk_size, workers):
+    chips_per_platform = defaultdict(list)
+    for chip_path in sorted(Path(data_dir).glob("**/*.npz")):
+        chips_per_platform[chip_path.parent.name].append(chip_path)
+
+    jobs = []
+    for platform, chips_path in chips_per_platform.items():
+        store_path = Path(output_dir) / platform
+        store_path.mkdir(parents=True, exist_ok=True)
+        with np.load(chips_path[0], allow_pickle=False) as chip:
+            arrays = {key: chip[key] for key in CHIP_COLUMNS}
+            if tile_size and chip["pixels"].shape[-1] % tile_size:
+                raise click.BadParameter(
+                    f"{tile_size} does not divide the {platform} chip size"
+                )
+            arrays["pixels"] = tile(chip["pixels"], tile_size)
+        for key, array in arrays.items():
+            np.lib.format.open_memmap(
+                store_path / f"{key}.npy",
+                mode="w+",
+                dtype=array.dtype,
+                shape=(len(chips_path), *array.shape),
+            )
+        np.save(
+            store_path / "names.npy",
+            np.array([chip_path.name for chip_path in chips_path]),
+        )
+        jobs += [
+            (store_path, start, chips_path[start : start + chunk_size], tile_size)
+            for start in range(0, len(chips_path), chunk_size)
+        ]
+
+    with Pool(workers) as pool:
+        num_chips = sum(pool.imap_unordered(write_chips, jobs))
+    print(f"Wrote {num_chips} chips to {len(chips_per_platform)} stores")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Convert a directory of npz chip files into shards for ClayDataModule with
+`data.data_format: shards`.
+
+The chips of every platform are shuffled & packed into shards of about
+`--shard-size-mb` each, written to `<output-dir>/<platform>/shard-XXXXX.bin`.
+A shard is the verbatim concatenation of the npz files, with the byte offsets
+& names of its chips in `shard-XXXXX.index.npz`. Shards are written in
+parallel, one per worker process.
+
+From the project root directory, do:
+
+    python -m scripts.convert_to_shards --data-dir data --output-dir shards
+"""
+
+from collections import defaultdict
+from multiprocessing import Pool
+from pathlib import Path
+
+import click
+import numpy as np
+
+from src.datamodule import shard_index_path
+
+
+def write_shard(job):
+    shard_path, chips_path = job
+    offsets = [0]
+    with open(shard_path, "wb") as f:
+        for chip_path in chips_path:
+            offsets.append(offsets[-1] + f.write(chip_path.read_bytes()))
+    np.savez(
+        shard_index_path(shard_path),
+        offsets=np.array(offsets, dtype=np.int64),
+        names=np.array([chip_path.name for chip_path in chips_path]),
+    )
+    return len(chips_path)
+
+
+@click.command()
+@click.option("--data-dir", default="data")
+@click.option("--output-dir", default="shards")
+@click.option("--shard-size-mb", default=1024)
+@click.option("--workers", default=8)
+@click.option("--seed", default=42)
+def main(data_dir, output_dir, shard_size_mb, workers, seed):  # noqa: PLR0913
+    chips_per_platform = defaultdict(list)
+    for chip_path in sorted(Path(data_dir).glob("**/*.npz")):
+        chips_per_platform[chip_path.parent.name].append(chip_path)
+
+    rng = np.random.default_rng(seed)
+    jobs = []
+    for platform, chips_path in chips_per_platform.items():
+        rng.shuffle(chips_path)
+        (Path(output_dir) / platform).mkdir(parents=True, exist_ok=True)
+        shards, size = [[]], 0
+        for chip_path in chips_path:
+            if size >= shard_size_mb * 1024**2:
+                shards.append([])
+                size = 0
+            shards[-1].append(chip_path)
+            size += chip_path.stat().st_size
+        jobs += [
+            (Path(output_dir) / platform / f"shard-{i:05d}.bin", shard)
+            for i, shard in enumerate(shards)
+        ]
+
+    with Pool(workers) as pool:
+        num_chips = sum(pool.imap_unordered(write_shard, jobs))
+    print(f"Wrote {num_chips} chips to {len(jobs)} shards in {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
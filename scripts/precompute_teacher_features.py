@@ -0,0 +1,85 @@
+"""
+Precompute the teacher CLS features of every chip, to pretrain ClayMAE with
+`model.teacher_features: True` & `data.teacher_features_dir` instead of running
+the teacher in every training step.
+
+Features are computed on the full chip resized to the teacher input size, for
+the 4 flips the datamodule can apply (unflipped, horizontal, vertical & both).
+They are saved as float16 with shape [b2 4 D] to
+`<output-dir>/<platform>/<chip name>.npz`, keep it outside of the data
+directory. Random crops are not covered, the student is matched to the features
+of the full chip, i.e. a global view of its crop.
+
+From the project root directory, do:
+
+    python -m scripts.precompute_teacher_features --data-dir data \
+        --output-dir teacher-features
+"""
+
+from pathlib import Path
+
+import click
+import numpy as np
+import timm
+import torch
+import yaml
+from box import Box
+from einops import rearrange
+from torchvision.transforms import v2
+
+from src.datamodule import flip_chips
+from src.model import TEACHER_CHIP_SIZE, to_teacher_rgb
+
+
+@click.command()
+@click.option("--data-dir", default="data")
+@click.option("--output-dir", default="teacher-features")
+@click.option("--metadata-path", default="configs/metadata.yaml")
+@click.option("--teacher", default="vit_base_patch16_224.dino")
+@click.option("--batch-size", default=64)
+@click.option("--overwrite", is_flag=True)
+@click.option("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+def main(  # noqa: PLR0913
+    data_dir, output_dir, metadata_path, teacher, batch_size, overwrite, device
+):
+    metadata = Box(yaml.safe_load(open(metadata_path)))
+    model = timm.create_model(teacher, pretrained=True, num_classes=0)
+    model = model.to(device).eval()
+    resize = v2.Resize(size=(TEACHER_CHIP_SIZE, TEACHER_CHIP_SIZE))
+    normalize = {
+        platform: v2.Normalize(
+            mean=list(meta.bands.mean.values()), std=list(meta.bands.std.values())
+        )
+        for platform, meta in metadata.items()
+    }
+
+    chips_path = sorted(Path(data_dir).glob("**/*.npz"))
+    print(f"Total number of chips: {len(chips_path)}")
+    for chip_path in chips_path:
+        platform = chip_path.parent.name
+        features_path = Path(output_dir) / platform / chip_path.name
+        if platform not in metadata or (features_path.exists() and not overwrite):
+            continue
+
+        with np.load(chip_path, allow_pickle=False) as chip:
+            pixels = torch.from_numpy(chip["pixels"].astype(np.float32))
+        pixels = normalize[platform](pixels).to(device)  # [b2 C H W]
+        # Variant index is hflip + 2 * vflip, see src.datamodule.flip_variant
+        variants = torch.cat(
+            [
+                flip_chips(pixels, hflip, vflip)
+                for vflip in (False, True)
+                for hflip in (False, True)
+            ]
+        )  # [(4 b2) C H W]
+        rgb = resize(to_teacher_rgb(platform, variants, metadata))
+        with torch.no_grad():
+            features = torch.cat([model(batch) for batch in rgb.split(batch_size)])
+        features = rearrange(features, "(v b2) d -> b2 v d", v=4)
+
+        features_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(features_path, teacher=features.half().cpu().numpy())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Exact per-band statistics of the chips of a data directory, computed in
+parallel over a ChipManifest, to regenerate the `mean` & `std` of
+`configs/metadata.yaml`.
+
+Every job reduces a chunk of chips of a platform to per-band moments, the
+pixel count, mean & sum of squared deviations from the mean (`m2`), updated
+chip by chip with Welford's method. Moments of chunks merge exactly with the
+parallel formula of Chan et al., so memory does not grow with the number of
+chips. Histograms over fixed bin edges merge by addition, percentiles are
+interpolated from them.
+
+Use it with `scripts/compute_band_stats.py`.
+"""
+
+from multiprocessing import Pool
+
+import numpy as np
+
+
+class BandMoments:
+    """Mergeable count, mean, m2, min & max of every band"""
+
+    def __init__(self, num_bands):
+        self.count = np.zeros(num_bands, dtype=np.int64)
+        self.mean = np.zeros(num_bands)
+        self.m2 = np.zeros(num_bands)
+        self.min = np.full(num_bands, np.inf)
+        self.max = np.full(num_bands, -np.inf)
+
+    def update(self, pixels, valid):
+        """Add the pixels [C N] of a chip, where `valid`"""
+        moments = BandMoments(len(pixels))
+        moments.count = valid.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            moments.mean = np.where(valid, pixels, 0).sum(axis=1) / moments.count
+        moments.mean = np.nan_to_num(moments.mean)
+        deviations = np.where(valid, pixels - moments.mean[:, None], 0)
+        moments.m2 = np.square(deviations).sum(axis=1)
+        moments.min = np.where(valid, pixels, np.inf).min(axis=1)
+        moments.max = np.where(valid, pixels, -np.inf).max(axis=1)
+        self.merge(moments)
+
+    def merge(self, other):
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        weight = np.divide(
+            other.count, count, out=np.zeros(len(count)), where=count > 0
+        )
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + other.m2 + np.square(delta) * self.count * weight
+        self.count = count
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / np.maximum(self.count, 1))
+
+
+class BandHistogram:
+    """Mergeable histogram of every band, over fixed bin edges [C bins+1]"""
+
+    def __init__(self, edges):
+        self.edges = edges
+        self.counts = np.zeros((len(edges), edges.shape[1] - 1), dtype=np.int64)
+
+    def update(self, pixels, valid):
+        """Add the pixels [C N] of a chip, where `valid`"""
+        for band, (values, mask) in enumerate(zip(pixels, valid)):
+            self.counts[band] += np.histogram(values[mask], bins=self.edges[band])[0]
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def percentiles(self, q):
+        """Percentiles `q` of every band [C len(q)], linear within bins"""
+        cdf = np.cumsum(self.counts, axis=1)
+        cdf = cdf / np.maximum(cdf[:, -1:], 1)
+        return np.stack(
+            [
+                np.interp(np.asarray(q) / 100, np.concatenate([[0], band_cdf]), edges)
+                for band_cdf, edges in zip(cdf, self.edges)
+            ]
+        )
+
+
+def histogram_edges(moments, bins):
+    """Bin edges [C bins+1] spanning the range of every band of BandMoments"""
+    low = np.where(np.isfinite(moments.min), moments.min, 0)
+    high = np.maximum(np.where(np.isfinite(moments.max), moments.max, 0), low + 1)
+    return np.linspace(low, high, bins + 1, axis=1)
+
+
+def read_pixels(chip_path, nodata):
+    """Pixels [C N] of the chips of a file, with the mask of valid ones"""
+    with np.load(chip_path, allow_pickle=False) as chip:
+        pixels = chip["pixels"]  # [b2 C H W]
+    pixels = pixels.swapaxes(0, 1).reshape(pixels.shape[1], -1).astype(np.float64)
+    valid = np.isfinite(pixels)
+    if nodata:
+        valid &= ~np.isin(pixels, nodata)
+    return pixels, valid
+
+
+def chunk_stats(job):
+    """Moments, or histograms over `edges`, of a chunk of chips of a platform"""
+    platform, chips_path, nodata, edges = job
+    stats = None
+    for chip_path in chips_path:
+        pixels, valid = read_pixels(chip_path, nodata)
+        if stats is None:
+            stats = BandMoments(len(pixels)) if edges is None else BandHistogram(edges)
+        stats.update(pixels, valid)
+    return platform, stats
+
+
+def compute_band_stats(  # noqa: PLR0913
+    manifest, platforms, nodata=(), edges=None, workers=8, chunk_size=256
+):
+    """
+    BandMoments of every platform of a ChipManifest, or BandHistogram with the
+    bin `edges` [C bins+1] of every platform
+    """
+    jobs = (
+        (
+            platform,
+            [manifest[i] for i in indices[start : start + chunk_size]],
+            list(nodata),
+            None if edges is None else edges[platform],
+        )
+        for platform, indices in manifest.platform_indices(platforms).items()
+        for start in range(0, len(indices), chunk_size)
+    )
+    stats = {}
+    with Pool(workers) as pool:
+        for platform, chunk in pool.imap_unordered(chunk_stats, jobs):
+            if platform not in stats:
+                stats[platform] = chunk
+            else:
+                stats[platform].merge(chunk)
+    return stats
@@ -3,32 +3,59 @@ from lightning.pytorch.callbacks.finetuning import BaseFinetuning
 
 
 class ProgressiveResizing(Callback):
-    def __init__(self):
-        self.resize_schedule = {
-            0: {"batch_size": 4, "num_workers": 4, "size": 64},
-            10: {"batch_size": 2, "num_workers": 2, "size": 128},
-            20: {"batch_size": 1, "num_workers": 1, "size": 256},
-        }
+    def __init__(self, schedule: dict[int, dict]):
+        """Resizes the data of a ClayDataModule on a schedule of epochs.
 
-    def on_train_epoch_start(self, trainer, pl_module):
-        if trainer.current_epoch in self.resize_schedule:
-            params = self.resize_schedule[trainer.current_epoch]
+        The datamodule is resized in place, see `ClayDataModule.resize`, so
+        the train/val split & the persistent dataloader workers are kept.
+        Dataloaders are reloaded every epoch, for Lightning to count the
+        batches of the new batch size, ClayDataModule returns the same ones.
 
-            trainer.datamodule.size = params["size"]
-            trainer.datamodule.batch_size = params["batch_size"]
-            trainer.datamodule.num_workers = params["num_workers"]
+        Args:
+            schedule (Dict): The `size` & `batch_size` from each epoch on, set
+            in the trainer callbacks of the config, e.g.
+
+                - class_path: src.callbacks.ProgressiveResizing
+                  init_args:
+                    schedule:
+                      0: {size: 128, batch_size: 32}
+                      10: {size: 224, batch_size: 8}
+        """
+        super().__init__()
+        self.schedule = {int(epoch): params for epoch, params in schedule.items()}
 
-            trainer.datamodule.setup(stage="fit")
+    def setup(self, trainer, pl_module, stage):
+        """Starts with the first size, resuming restores the one of the epoch."""
+        trainer.reload_dataloaders_every_n_epochs = 1
+        if stage == "fit" and 0 in self.schedule:
+            trainer.datamodule.resize(**self.schedule[0])
 
-    def on_validation_epoch_start(self, trainer, pl_module):
-        if trainer.current_epoch in self.resize_schedule:
-            params = self.resize_schedule[trainer.current_epoch]
+    def scheduled(self, epoch):
+        """Size & batch size of an epoch, from the last entry at or before it"""
+        starts = [start for start in self.schedule if start <= epoch]
+        return self.schedule[max(starts)] if starts else None
 
-            trainer.datamodule.size = params["size"]
-            trainer.datamodule.batch_size = params["batch_size"]
-            trainer.datamodule.num_workers = params["num_workers"]
+    def on_load_checkpoint(self, trainer, pl_module, checkpoint):
+        """
+        Resizes for the epoch training resumes at, once the datamodule state
+        is restored & before the dataloaders are loaded. Checkpoints saved at
+        the end of validation hold the size of their epoch, Lightning may
+        start the next one from them without calling on_train_epoch_end.
+        """
+        progress = checkpoint["loops"]["fit_loop"]["epoch_progress"]["current"]
+        epoch = progress["processed"]  # the epoch Lightning resumes at
+        datamodule = trainer.datamodule
+        params = self.scheduled(epoch)
+        if epoch == datamodule.consumed_epoch or params is None:
+            return  # the restored epoch, its batches are counted in its size
+        if any(getattr(datamodule, key) != value for key, value in params.items()):
+            datamodule.resize(**params)
 
-            trainer.datamodule.setup(stage="validate")
+    def on_train_epoch_end(self, trainer, pl_module):
+        """Resizes for the next epoch, before its dataloaders are reloaded."""
+        next_epoch = trainer.current_epoch + 1
+        if next_epoch in self.schedule:
+            trainer.datamodule.resize(**self.schedule[next_epoch])
 
 
 class LayerwiseFinetuning(BaseFinetuning):
@@ -24,6 +24,8 @@ References:
 - https://github.com/ashleve/lightning-hydra-template/blob/wandb-callbacks/src/callbacks/wandb_callbacks.py#L245
 """
 
+import itertools
+
 import lightning as L
 import matplotlib.pyplot as plt
 import numpy as np
@@ -176,6 +178,22 @@ class LogIntermediatePredictions(L.Callback):
         """
         super().__init__()
 
+    @staticmethod
+    def first_platform(batch):
+        """
+        Chips of the first platform of a batch, the only ones of a batch
+        mixing platforms that are plotted. Chips are grouped by platform.
+        """
+        if not isinstance(batch["pixels"], list):
+            return batch
+        num_chips = len(batch["pixels"][0])
+        return {
+            "pixels": batch["pixels"][0],
+            "time": batch["time"][:num_chips],
+            "latlon": batch["latlon"][:num_chips],
+            "platform": batch["platform"][:num_chips],
+        }
+
     def on_validation_end(
         self,
         trainer: L.Trainer,
@@ -187,21 +205,28 @@ class LogIntermediatePredictions(L.Callback):
         & logs the model predictions to wandb-logger for humans to interpret
         how model evolves over time.
         """
+        if isinstance(trainer.strategy, L.pytorch.strategies.FSDPStrategy):
+            # The encoder & decoder are called outside of the FSDP root
+            # forward, their sharded parameters would not be gathered
+            return
+
         with torch.no_grad():
             # Get WandB logger
             self.logger = get_wandb_logger(trainer=trainer)
 
             # get the val dataloader
             val_dl = iter(trainer.val_dataloaders)
-            for i in range(6):
-                batch = next(val_dl)
+            for val_batch in itertools.islice(val_dl, 6):
+                batch = self.first_platform(val_batch)
                 platform = batch["platform"][0]
 
                 batch = {
-                    k: v.to(pl_module.device)
+                    k: v.to(pl_module.device) if isinstance(v, torch.Tensor) else v
                     for k, v in batch.items()
-                    if isinstance(v, torch.Tensor)
                 }
+                if trainer.datamodule.augment_on_device:
+                    # Crop & normalize, on_after_batch_transfer is not called
+                    batch = trainer.datamodule.augmentation(batch)
 
                 waves = torch.tensor(
                     list(
@@ -249,9 +274,11 @@ class LogIntermediatePredictions(L.Callback):
                 assert pixels.shape == batch["pixels"].shape
 
                 n_rows = 4  # 2 for actual and 2 for predicted
-                n_cols = 8
+                n_cols = min(8, len(pixels) // 2)
+                if n_cols == 0:
+                    continue
 
-                fig, axs = plt.subplots(n_rows, n_cols, figsize=(20, 8))
+                fig, axs = plt.subplots(n_rows, n_cols, figsize=(20, 8), squeeze=False)
 
                 for j in range(n_cols):
                     # Plot actual images in rows 0 and 2
@@ -282,4 +309,4 @@ class LogIntermediatePredictions(L.Callback):
                     axs[3, j].axis("off")
 
                 self.logger.experiment.log({f"{platform}": wandb.Image(fig)})
-            plt.close(fig)
+                plt.close(fig)
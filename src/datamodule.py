@@ -3,126 +3,811 @@ LightningDataModule to load Earth Observation data from GeoTIFF files using
 rasterio.
 """
 
-from collections import defaultdict
-from pathlib import Path
+import io
+import os
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path, PurePosixPath
 from typing import List, Literal
 
 import lightning as L
 import numpy as np
 import torch
-import torchdata
 import yaml
 from box import Box
 from einops import rearrange
-from sklearn.model_selection import train_test_split
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, IterableDataset, get_worker_info
 from torch.utils.data.sampler import Sampler
-from torchvision.transforms import v2
+
+from src.manifest import ChipManifest, chip_id, hash_fraction
+from src.s3cache import S3ChipCache
+
+
+def flip_variant(hflip, vflip):
+    """Index of the flip variant, 0 unflipped, 1 horizontal, 2 vertical, 3 both"""
+    return int(hflip) + 2 * int(vflip)
+
+
+def flip_chips(pixels, hflip, vflip):
+    """Flip chips of shape [... H W] horizontally and/or vertically"""
+    dims = [dim for dim, flip in ((-1, hflip), (-2, vflip)) if flip]
+    return torch.flip(pixels, dims=dims) if dims else pixels
 
 
 class EODataset(Dataset):
-    """Reads different Earth Observation data sources from a directory."""
+    """
+    Reads different Earth Observation data sources from a directory.
 
-    def __init__(
-        self, chips_path: List[Path], size: int, platforms: list, metadata: Box
+    With `teacher_features_dir`, the precomputed teacher features of every
+    chip are returned too, for the flips applied to it. See
+    `scripts/precompute_teacher_features.py`.
+
+    With `augment_on_device`, chips are returned as read, with the teacher
+    features of the 4 flips, to be flipped, cropped & normalized in batch by
+    DeviceAugmentation after the transfer to the training device.
+
+    The chip files of a batch, as yielded by ClaySampler, are read together
+    by `__getitems__` with `io_threads` threads, then each is cropped, flipped
+    & normalized in a single pass.
+
+    The crop `size` is kept in shared memory, so that setting it on the
+    dataset resizes the chips of live dataloader workers too.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        chips_path: List[Path],
+        size: int,
+        platforms: list,
+        metadata: Box,
+        teacher_features_dir: str | None = None,
+        augment_on_device: bool = False,
+        io_threads: int = 4,
     ) -> None:
         super().__init__()
         self.chips_path = chips_path
-        self.size = size
-        self.transforms = {}
+        self.shared_size = torch.tensor(size).share_memory_()
+        self.teacher_features_dir = teacher_features_dir
+        self.augment_on_device = augment_on_device
+        self.io_threads = io_threads
+        self._read_pool = self._read_pool_pid = None
+        self.scale, self.shift = {}, {}
 
-        # Generate transforms for each platform using a helper function
+        # Normalization of each platform as one multiply-add, (x - mean) / std
         for platform in platforms:
-            mean = list(metadata[platform].bands.mean.values())
-            std = list(metadata[platform].bands.std.values())
-            self.transforms[platform] = self.create_transforms(mean, std)
+            mean = torch.tensor(list(metadata[platform].bands.mean.values()))
+            std = torch.tensor(list(metadata[platform].bands.std.values()))
+            self.scale[platform] = (1 / std)[:, None, None]
+            self.shift[platform] = (-mean / std)[:, None, None]
 
-    def create_transforms(self, mean, std):
-        return v2.Compose(
-            [
-                v2.RandomHorizontalFlip(p=0.5),
-                v2.RandomVerticalFlip(p=0.5),
-                v2.RandomCrop(size=(self.size, self.size)),
-                v2.Normalize(mean=mean, std=std),
-            ]
-        )
+    @property
+    def size(self):
+        return self.shared_size.item()
+
+    @size.setter
+    def size(self, size):
+        self.shared_size.fill_(size)
 
     def __len__(self):
         return len(self.chips_path)
 
+    def __getstate__(self):
+        # The reading threads are started again in every dataloader worker
+        return {**self.__dict__, "_read_pool": None, "_read_pool_pid": None}
+
+    @property
+    def read_pool(self):
+        if self._read_pool_pid != os.getpid():
+            self._read_pool = ThreadPoolExecutor(self.io_threads)
+            self._read_pool_pid = os.getpid()
+        return self._read_pool
+
     def __getitem__(self, idx):
+        chip, platform, name = self.read_chip(idx)
+        return self.prepare_chip(chip, platform, name)
+
+    def __getitems__(self, indices):
+        """Read the chip files of a batch concurrently & augment them"""
+        chips = self.read_pool.map(self.read_chip, indices)
+        return [self.prepare_chip(*chip) for chip in chips]
+
+    def read_chip(self, idx):
         chip_path = self.chips_path[idx]
-        with np.load(chip_path, allow_pickle=False) as chip:
-            pixels = torch.from_numpy(chip["pixels"].astype(np.float32))
-            platform = chip_path.parent.name
-            pixels = self.transforms[platform](pixels)
-
-            # Prepare additional information
-            additional_info = {
-                "platform": platform,
-                "time": torch.tensor(
-                    np.hstack((chip["week_norm"], chip["hour_norm"])),
-                    dtype=torch.float32,
-                ),
-                "latlon": torch.tensor(
-                    np.hstack((chip["lat_norm"], chip["lon_norm"])), dtype=torch.float32
-                ),
-            }
+        return self.load_chip(chip_path, chip_path.parent.name, chip_path.name)
+
+    def load_chip(self, file, platform, name):
+        """Arrays of a chip file or file object, with its platform & name"""
+        with np.load(file, allow_pickle=False) as chip:
+            arrays = {key: chip[key] for key in ("pixels", *CHIP_COLUMNS)}
+        if self.teacher_features_dir is not None:
+            arrays["teacher"] = self.read_teacher_features(platform, name)
+        return arrays, platform, name
+
+    def read_teacher_features(self, platform, name):
+        features_path = Path(self.teacher_features_dir) / platform / name
+        with np.load(features_path, allow_pickle=False) as features:
+            return features["teacher"]  # [b2 4 D]
+
+    def chip_info(self, chip, platform):
+        """Platform, time & location of the chips of a chip file"""
+        return {
+            "platform": platform,
+            "time": torch.tensor(
+                np.hstack((chip["week_norm"], chip["hour_norm"])),
+                dtype=torch.float32,
+            ),
+            "latlon": torch.tensor(
+                np.hstack((chip["lat_norm"], chip["lon_norm"])), dtype=torch.float32
+            ),
+        }
+
+    def prepare_chip(self, chip, platform, name):
+        """
+        Crop, flip & normalize the pixels of a chip file, as read by
+        `read_chip`, in a single pass over its crop window & gather its metadata
+        """
+        item = self.chip_info(chip, platform)
+        if self.augment_on_device:
+            item["pixels"] = torch.from_numpy(
+                chip["pixels"].astype(np.float32, copy=False)
+            )
+            if self.teacher_features_dir is not None:
+                item["teacher_features"] = torch.from_numpy(chip["teacher"]).float()
+            return item
+
+        size = self.size
+        *_, height, width = chip["pixels"].shape
+        hflip, vflip = torch.randint(2, (2,)).bool().tolist()
+        top = torch.randint(height - size + 1, (1,)).item()
+        left = torch.randint(width - size + 1, (1,)).item()
+        window = torch.from_numpy(chip["pixels"])[
+            ..., top : top + size, left : left + size
+        ]
+        item["pixels"] = torch.addcmul(
+            self.shift[platform], flip_chips(window, hflip, vflip), self.scale[platform]
+        )  # [b2 C size size]
+        if self.teacher_features_dir is not None:
+            teacher = chip["teacher"][:, flip_variant(hflip, vflip)]  # [b2 D]
+            item["teacher_features"] = torch.from_numpy(teacher).float()
+        return item
+
+
+CHIP_COLUMNS = ("week_norm", "hour_norm", "lat_norm", "lon_norm")
+
+
+def memmap_chips_path(store_dir):
+    """List the chips of a memory-mapped store as `<store>/<platform>/<name>`"""
+    chips_path = []
+    for names_path in sorted(Path(store_dir).glob("*/names.npy")):
+        chips_path += [names_path.parent / str(name) for name in np.load(names_path)]
+    return chips_path
+
+
+class MemmapEODataset(EODataset):
+    """
+    Reads chips from the memory-mapped store written by
+    `scripts/convert_to_memmap.py`, with `chips_path` as listed by
+    `memmap_chips_path`.
+
+    Every platform directory of the store holds the uncompressed pixels of all
+    its chips in a single `pixels.npy` array of shape [N b2 C H W], & the
+    metadata in columnar side arrays of shape [N b2 2]. The pixels are mapped
+    copy-on-write, so the crop windows are read as views of the page cache
+    without any copy.
+
+    Stores written with `--tile-size` hold the pixels as square tiles of shape
+    [N b2 C nH nW t t]. The random crop window is then drawn first & only the
+    tiles covering it are read, so I/O scales with the crop area.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        chips_path: List[Path],
+        size: int,
+        platforms: list,
+        metadata: Box,
+        teacher_features_dir: str | None = None,
+        augment_on_device: bool = False,
+        io_threads: int = 4,
+    ) -> None:
+        super().__init__(
+            chips_path=chips_path,
+            size=size,
+            platforms=platforms,
+            metadata=metadata,
+            teacher_features_dir=teacher_features_dir,
+            augment_on_device=augment_on_device,
+            io_threads=io_threads,
+        )
+        self.stores = {}  # opened lazily, in every dataloader worker
+
+    def __getstate__(self):
+        # Do not pickle the mapped arrays into the workers
+        return {**super().__getstate__(), "stores": {}}
+
+    def open_store(self, store_path):
+        store = {"pixels": np.load(store_path / "pixels.npy", mmap_mode="c")}
+        for column in CHIP_COLUMNS:
+            store[column] = np.load(store_path / f"{column}.npy")
+        names = np.load(store_path / "names.npy")
+        store["rows"] = {str(name): row for row, name in enumerate(names)}
+        return store
+
+    def read_chip(self, idx):
+        chip_path = self.chips_path[idx]
+        if chip_path.parent not in self.stores:
+            self.stores[chip_path.parent] = self.open_store(chip_path.parent)
+        store = self.stores[chip_path.parent]
+        row = store["rows"][chip_path.name]
+        chip = {key: store[key][row] for key in ("pixels", *CHIP_COLUMNS)}
+        if chip["pixels"].ndim == 6:  # noqa: PLR2004 [b2 C nH nW t t] tiles
+            chip["pixels"] = self.read_window(chip["pixels"])
+        platform, name = chip_path.parent.name, chip_path.name
+        if self.teacher_features_dir is not None:
+            chip["teacher"] = self.read_teacher_features(platform, name)
+        return chip, platform, name
 
-        return {"pixels": pixels, **additional_info}
+    def read_window(self, tiles):
+        """Read a random crop window from the tiles [b2 C nH nW t t] of a chip"""
+        size = self.size
+        *_, nh, nw, t, _ = tiles.shape
+        top, left = (torch.randint(n * t - size + 1, (1,)).item() for n in (nh, nw))
+        rows = slice(top // t, (top + size - 1) // t + 1)
+        cols = slice(left // t, (left + size - 1) // t + 1)
+        window = rearrange(
+            tiles[:, :, rows, cols], "b2 c nh nw th tw -> b2 c (nh th) (nw tw)"
+        )
+        top, left = top % t, left % t
+        # The crop of prepare_chip is a no-op on the window
+        return window[..., top : top + size, left : left + size]
+
+
+class S3EODataset(EODataset):
+    """
+    Reads chips from S3 through a node-local S3ChipCache, with `chips_path`
+    the `bucket/prefix/<platform>/<name>.npz` keys of the chips. The chips of
+    a batch are fetched concurrently by the threads of the cache.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        chips_path: List[PurePosixPath],
+        size: int,
+        platforms: list,
+        metadata: Box,
+        cache: S3ChipCache,
+        teacher_features_dir: str | None = None,
+        augment_on_device: bool = False,
+        io_threads: int = 4,
+    ) -> None:
+        super().__init__(
+            chips_path=chips_path,
+            size=size,
+            platforms=platforms,
+            metadata=metadata,
+            teacher_features_dir=teacher_features_dir,
+            augment_on_device=augment_on_device,
+            io_threads=io_threads,
+        )
+        self.cache = cache
+
+    @property
+    def read_pool(self):
+        return self.cache.pool  # up to `max_concurrency` downloads at once
+
+    def read_chip(self, idx):
+        key = self.chips_path[idx]
+        data = io.BytesIO(self.cache.fetch(str(key)))
+        return self.load_chip(data, key.parent.name, key.name)
+
+
+def shard_index_path(shard_path):
+    """Path of the offset index next to a `shard-XXXXX.bin` file"""
+    return Path(shard_path).with_suffix(".index.npz")
+
+
+class ShardedEODataset(EODataset, IterableDataset):
+    """
+    Reads the chips of large shard files sequentially, see
+    `scripts/convert_to_shards.py`, and yields collated batches.
+
+    A shard is the verbatim concatenation of the npz chip files of a platform,
+    with the byte offsets & names of its chips in a `.index.npz` file. The
+    shards of each rank are shuffled every epoch & split across the dataloader
+    workers. Each worker reads `shards_in_flight` shards at a time, one chip
+    after the other, into a shuffle buffer of `shuffle_buffer` chips and draws
+    chips from it at random.
+
+    Every rank runs the same number of steps, the number of chips of all
+    shards over `world_size` divided into batches, whatever the number of
+    chips of its own shards. Every worker yields its share of these batches,
+    cycling through its shards. Batches hold one platform unless
+    `mix_platforms`, and platforms are sampled in proportion to their number of
+    chips rather than in turns as with ClaySampler.
+
+    Like `size`, the `batch_size` & the epoch set by `set_epoch` are shared
+    with the dataloader workers, which pick them up at the start of every
+    epoch. The order of an epoch is drawn from `seed`, the epoch, the rank &
+    the worker, so persistent workers & ranks reading the same shards do not
+    repeat each other.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        shards_path: List[Path],
+        size: int,
+        platforms: list,
+        metadata: Box,
+        batch_size: int,
+        mix_platforms: bool = False,
+        shuffle_buffer: int = 64,
+        shards_in_flight: int = 4,
+        rank: int = 0,
+        world_size: int = 1,
+        seed: int = 0,
+        teacher_features_dir: str | None = None,
+        augment_on_device: bool = False,
+    ) -> None:
+        super().__init__(
+            chips_path=[],
+            size=size,
+            platforms=platforms,
+            metadata=metadata,
+            teacher_features_dir=teacher_features_dir,
+            augment_on_device=augment_on_device,
+        )
+        # Chips of the shards of all ranks, shards hold different numbers of
+        # chips, the batches of a rank are counted from the total
+        shards_path = sorted(shards_path)
+        self.num_chips = 0
+        for shard_path in shards_path:
+            with np.load(shard_index_path(shard_path)) as index:
+                self.num_chips += len(index["names"])
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.shared_epoch = torch.tensor(0).share_memory_()
+
+        # Ranks read disjoint shards, unless there are fewer shards than ranks
+        if len(shards_path) >= world_size:
+            shards_path = shards_path[rank::world_size]
+        self.shards_path = shards_path
+        self.shared_batch_size = torch.tensor(batch_size).share_memory_()
+        self.mix_platforms = mix_platforms
+        self.shuffle_buffer = shuffle_buffer
+        self.shards_in_flight = shards_in_flight
+
+    @property
+    def batch_size(self):
+        return self.shared_batch_size.item()
+
+    @batch_size.setter
+    def batch_size(self, batch_size):
+        self.shared_batch_size.fill_(batch_size)
+
+    @property
+    def epoch(self):
+        return self.shared_epoch.item()
+
+    def set_epoch(self, epoch):
+        self.shared_epoch.fill_(epoch)
+
+    def __len__(self):
+        return self.num_chips // self.world_size // self.batch_size
+
+    def read_shard(self, shard_path):
+        """Yield the platform, name & raw npz bytes of every chip of a shard"""
+        with np.load(shard_index_path(shard_path)) as index:
+            offsets, names = index["offsets"], index["names"]
+        platform = Path(shard_path).parent.name
+        with open(shard_path, "rb", buffering=8 * 1024 * 1024) as f:
+            for name, start, end in zip(names, offsets[:-1], offsets[1:]):
+                yield platform, str(name), f.read(end - start)
+
+    def read_shards(self, shards_path, rng):
+        """Interleave the chips of `shards_in_flight` shards, cycling forever"""
+        while True:
+            pending = [shards_path[i] for i in rng.permutation(len(shards_path))]
+            in_flight = []
+            while pending or in_flight:
+                while pending and len(in_flight) < self.shards_in_flight:
+                    in_flight.append(self.read_shard(pending.pop()))
+                for shard in list(in_flight):
+                    chip = next(shard, None)
+                    if chip is None:
+                        in_flight.remove(shard)
+                    else:
+                        yield chip
+
+    def __iter__(self):
+        worker = get_worker_info()
+        if worker is None:
+            num_workers, worker_id = 1, 0
+        else:
+            num_workers, worker_id = worker.num_workers, worker.id
+        epoch = self.epoch
+        batch_size = self.batch_size
+        total = self.num_chips // self.world_size // batch_size
+        num_batches = total // num_workers + (worker_id < total % num_workers)
+        if num_batches == 0:
+            return
+
+        # Shuffle the shards the same way in every worker to split them
+        order = np.random.default_rng((self.seed, epoch, self.rank))
+        shards_path = [
+            self.shards_path[i] for i in order.permutation(len(self.shards_path))
+        ]
+        if len(shards_path) >= num_workers:
+            shards_path = shards_path[worker_id::num_workers]
+        rng = np.random.default_rng((self.seed, epoch, self.rank, worker_id))
+
+        buffer = []
+        buckets = defaultdict(list)
+        for entry in self.read_shards(shards_path, rng):
+            buffer.append(entry)
+            if len(buffer) < self.shuffle_buffer:
+                continue
+            # Swap a random chip to the end of the buffer & decode it
+            i = rng.integers(len(buffer))
+            buffer[i], buffer[-1] = buffer[-1], buffer[i]
+            platform, name, data = buffer.pop()
+            item = self.prepare_chip(*self.load_chip(io.BytesIO(data), platform, name))
+
+            bucket = buckets[None if self.mix_platforms else platform]
+            bucket.append(item)
+            if len(bucket) == batch_size:
+                yield batch_collate(bucket)
+                bucket.clear()
+                num_batches -= 1
+                if num_batches == 0:
+                    return
 
 
 class ClaySampler(Sampler):
-    def __init__(self, dataset, platforms, batch_size):
+    """
+    Batches of one platform at a time, in turns, or mixing platforms with
+    `mix_platforms`. Platforms are repeated up to the size of the largest one,
+    platforms without chips are skipped.
+
+    The order of an epoch is drawn from `seed` & the epoch set by `set_epoch`,
+    so it is the same on every rank, and every rank gets its own block of the
+    batches. Blocks are disjoint & of equal length, the last batches of an
+    epoch are dropped if they cannot be split evenly between ranks.
+
+    `load_state_dict` resumes an epoch after the batches already consumed.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        dataset,
+        platforms,
+        batch_size,
+        mix_platforms=False,
+        rank=0,
+        world_size=1,
+        seed=0,
+    ):
         self.dataset = dataset
-        self.platforms = platforms
         self.batch_size = batch_size
+        self.mix_platforms = mix_platforms
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0  # of this rank's block, to resume an epoch
 
-        self.cubes_per_platform = {platform: [] for platform in platforms}
-        for idx, chip_path in enumerate(self.dataset.chips_path):
-            platform = chip_path.parent.name
-            self.cubes_per_platform[platform].append(idx)
+        if isinstance(self.dataset.chips_path, ChipManifest):
+            self.cubes_per_platform = self.dataset.chips_path.platform_indices(
+                platforms
+            )
+        else:
+            self.cubes_per_platform = {platform: [] for platform in platforms}
+            for idx, chip_path in enumerate(self.dataset.chips_path):
+                platform = chip_path.parent.name
+                self.cubes_per_platform[platform].append(idx)
+        # Skip platforms without chips, e.g. small ones on one side of a split
+        self.platforms = [
+            platform
+            for platform in platforms
+            if len(self.cubes_per_platform[platform]) > 0
+        ]
 
-    def __iter__(self):
+    @property
+    def sampler(self):
+        """Lightning calls `set_epoch` on the `sampler` of a batch sampler"""
+        return self
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self.start_batch = 0
+        self.epoch = epoch
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch}
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict["seed"]
+        self.epoch = state_dict["epoch"]
+        self.start_batch = state_dict.get("batches_consumed", 0)
+
+    def epoch_batches(self):
+        """Batches of the epoch across all ranks"""
         cubes_per_platform_per_epoch = {}
-        rng = np.random.default_rng()
+        rng = np.random.default_rng((self.seed, self.epoch))
         # Shuffle and adjust sizes
         max_len = max(len(indices) for indices in self.cubes_per_platform.values())
         for platform in self.platforms:
-            indices = self.cubes_per_platform[platform]
-            rng.shuffle(indices)
+            indices = rng.permutation(self.cubes_per_platform[platform])
             repeated_indices = np.tile(indices, (max_len // len(indices) + 1))[:max_len]
             cubes_per_platform_per_epoch[platform] = repeated_indices
 
+        if self.mix_platforms:
+            # Shuffle all platforms together, so batches mix platforms
+            # Ignore the last batch if it is incomplete
+            indices = np.concatenate(list(cubes_per_platform_per_epoch.values()))
+            rng.shuffle(indices)
+            return [
+                indices[i : i + self.batch_size]
+                for i in range(0, len(indices) - self.batch_size + 1, self.batch_size)
+            ]
+
         # Create batches such that we return one platform per batch in cycle
         # Ignore the last batch if it is incomplete
+        batches = []
         for i in range(0, max_len, self.batch_size):
             for platform in self.platforms:
                 batch = cubes_per_platform_per_epoch[platform][i : i + self.batch_size]
                 if len(batch) == self.batch_size:
-                    yield batch
+                    batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        num_batches = len(self)
+        start = self.rank * num_batches
+        batches = self.epoch_batches()[start + self.start_batch : start + num_batches]
+        self.start_batch = 0  # the next iteration starts the epoch over
+        yield from batches
+
+    def __len__(self):
+        max_len = max(len(indices) for indices in self.cubes_per_platform.values())
+        if self.mix_platforms:
+            num_batches = len(self.platforms) * max_len // self.batch_size
+        else:
+            num_batches = len(self.platforms) * (max_len // self.batch_size)
+        return num_batches // self.world_size
+
+
+def allocate(total, weights):
+    """Split `total` proportionally to `weights`, by largest remainders"""
+    shares = total * np.asarray(weights) / np.sum(weights)
+    counts = np.floor(shares).astype(int)
+    counts[np.argsort(counts - shares)[: total - counts.sum()]] += 1
+    return counts
+
+
+class BudgetedClaySampler(ClaySampler):
+    """
+    ClaySampler drawing a fixed budget of `samples_per_epoch` chip files per
+    epoch, instead of repeating every platform up to the largest one.
+
+    Platforms are sampled with probabilities proportional to
+    `weight * num_chips ** (1 / temperature)`: a temperature of 1 samples
+    chips uniformly, higher temperatures flatten towards uniform platforms. The
+    `platform_weights` default to 1. Each platform is read through a sequence
+    of permutations of its chips that carries over from one epoch to the next,
+    so no chip repeats before all chips of its platform have been seen. Single
+    platform batches are drawn in a random order of platforms.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        dataset,
+        platforms,
+        batch_size,
+        samples_per_epoch,
+        platform_weights=None,
+        temperature=1.0,
+        mix_platforms=False,
+        rank=0,
+        world_size=1,
+        seed=0,
+    ):
+        super().__init__(
+            dataset=dataset,
+            platforms=platforms,
+            batch_size=batch_size,
+            mix_platforms=mix_platforms,
+            rank=rank,
+            world_size=world_size,
+            seed=seed,
+        )
+        self.samples_per_epoch = samples_per_epoch
+        platform_weights = platform_weights or {}
+        self.probabilities = np.array(
+            [
+                platform_weights.get(platform, 1.0)
+                * len(self.cubes_per_platform[platform]) ** (1 / temperature)
+                for platform in self.platforms
+            ]
+        )
+        self.probabilities /= self.probabilities.sum()
+
+    def platform_samples(self, i, start, count):
+        """`count` chips of the i-th platform from position `start` onwards"""
+        indices = np.asarray(self.cubes_per_platform[self.platforms[i]], dtype=int)
+        if count == 0:
+            return indices[:0]
+        cycle, offset = divmod(start, len(indices))
+        samples = []
+        while count > 0:
+            rng = np.random.default_rng((self.seed, i, cycle))
+            taken = rng.permutation(indices)[offset : offset + count]
+            samples.append(taken)
+            count -= len(taken)
+            cycle, offset = cycle + 1, 0
+        return np.concatenate(samples)
+
+    def epoch_batches(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        num_batches = self.samples_per_epoch // self.batch_size
+        if self.mix_platforms:
+            counts = allocate(num_batches * self.batch_size, self.probabilities)
+        else:
+            counts = allocate(num_batches, self.probabilities) * self.batch_size
+        samples = [
+            self.platform_samples(i, self.epoch * count, count)
+            for i, count in enumerate(counts)
+        ]
+
+        if self.mix_platforms:
+            samples = [rng.permutation(np.concatenate(samples))]
+        batches = np.concatenate([s.reshape(-1, self.batch_size) for s in samples])
+        return list(rng.permutation(batches))
+
+    def __len__(self):
+        return self.samples_per_epoch // self.batch_size // self.world_size
+
+
+class PrefetchBatchSampler(Sampler):
+    """
+    Wraps a batch sampler of an S3EODataset to download the chips of the next
+    `ahead` batches into the cache, from the main process, while the workers
+    read the current ones.
+    """
+
+    def __init__(self, batch_sampler, cache, ahead=8):
+        self.batch_sampler = batch_sampler
+        self.cache = cache
+        self.ahead = ahead
+
+    def __iter__(self):
+        chips_path = self.batch_sampler.dataset.chips_path
+        queue = deque()
+        for batch in self.batch_sampler:
+            self.cache.prefetch([str(chips_path[idx]) for idx in batch])
+            queue.append(batch)
+            if len(queue) > self.ahead:
+                yield queue.popleft()
+        yield from queue
+
+    @property
+    def sampler(self):
+        return self.batch_sampler.sampler
+
+    def set_epoch(self, epoch):
+        self.batch_sampler.set_epoch(epoch)
+
+    def state_dict(self):
+        return self.batch_sampler.state_dict()
+
+    def load_state_dict(self, state_dict):
+        self.batch_sampler.load_state_dict(state_dict)
 
     def __len__(self):
-        return len(self.dataset.chips_path) // self.batch_size
+        return len(self.batch_sampler)
+
+
+def concat_chips(tensors):
+    """
+    Concatenate tensors [b2 ...] into a single [(b1 b2) ...] tensor. In
+    dataloader workers, it is allocated in shared memory like default_collate
+    does, so it is sent to the main process without another copy.
+    """
+    shape = (sum(len(tensor) for tensor in tensors), *tensors[0].shape[1:])
+    out = None
+    if get_worker_info() is not None:
+        numel = shape[0] * tensors[0][0].numel()
+        storage = (
+            tensors[0]._typed_storage()._new_shared(numel, device=tensors[0].device)
+        )
+        out = tensors[0].new(storage).resize_(shape)
+    return torch.cat(tensors, out=out)
 
 
 def batch_collate(batch):
     """Collate function for DataLoader.
 
-    Merge the first two dimensions of the input tensors.
+    Merge the first two dimensions of the input tensors. Items are grouped by
+    platform, and batches mixing platforms return a list with one pixels
+    tensor per platform, in the order of the per sample platform list.
     """
+    batch = sorted(batch, key=lambda item: item["platform"])
+    pixels = defaultdict(list)
     d = defaultdict(list)
     for item in batch:
-        d["pixels"].append(item["pixels"])
+        pixels[item["platform"]].append(item["pixels"])
         d["time"].append(item["time"])
         d["latlon"].append(item["latlon"])
-        d["platform"].append(item["platform"])
-    return {
-        "pixels": rearrange(d["pixels"], "b1 b2 c h w -> (b1 b2) c h w"),
-        "time": rearrange(d["time"], "b1 b2 t -> (b1 b2) t"),
-        "latlon": rearrange(d["latlon"], "b1 b2 ll -> (b1 b2) ll"),
+        d["platform"].extend([item["platform"]] * len(item["pixels"]))
+        if "teacher_features" in item:
+            d["teacher_features"].append(item["teacher_features"])
+    pixels = [concat_chips(cubes) for cubes in pixels.values()]  # [(b1 b2) c h w]
+    collated = {
+        "pixels": pixels[0] if len(pixels) == 1 else pixels,
+        "time": concat_chips(d["time"]),  # [(b1 b2) t]
+        "latlon": concat_chips(d["latlon"]),  # [(b1 b2) ll]
         "platform": d["platform"],
     }
+    if d["teacher_features"]:
+        collated["teacher_features"] = concat_chips(d["teacher_features"])
+    return collated
+
+
+class DeviceAugmentation:
+    """
+    Random flips & crop and per platform normalization of a collated batch,
+    on the device it is on. Flips & crop offsets are drawn per chip & applied
+    in a single gather, the teacher features of the drawn flips are picked
+    from the 4 variants.
+    """
+
+    def __init__(self, size, platforms, metadata):
+        self.size = size
+        self.mean = {
+            platform: torch.tensor(list(metadata[platform].bands.mean.values()))
+            for platform in platforms
+        }
+        self.std = {
+            platform: torch.tensor(list(metadata[platform].bands.std.values()))
+            for platform in platforms
+        }
+
+    def crop_flip(self, pixels, hflip, vflip):
+        B, _, H, W = pixels.shape
+        grid = torch.arange(self.size, device=pixels.device)
+        top = (torch.rand(B, device=pixels.device) * (H - self.size + 1)).long()
+        left = (torch.rand(B, device=pixels.device) * (W - self.size + 1)).long()
+        # Flipping then cropping reads the crop window in reverse order
+        rows = top[:, None] + torch.where(vflip[:, None], grid.flip(0), grid)
+        cols = left[:, None] + torch.where(hflip[:, None], grid.flip(0), grid)
+        batch = torch.arange(B, device=pixels.device)
+        pixels = pixels[batch[:, None, None], :, rows[:, :, None], cols[:, None, :]]
+        return rearrange(pixels, "b h w c -> b c h w")
+
+    def __call__(self, batch):
+        pixels = batch["pixels"]
+        pixels = list(pixels) if isinstance(pixels, list) else [pixels]
+        device = pixels[0].device
+        hflip, vflip = torch.randint(2, (2, len(batch["platform"])), device=device)
+        hflip, vflip = hflip.bool(), vflip.bool()
+
+        start = 0
+        for i, cubes in enumerate(pixels):
+            platform, end = batch["platform"][start], start + len(cubes)
+            cropped = self.crop_flip(cubes, hflip[start:end], vflip[start:end])
+            mean = self.mean[platform].to(cropped)[:, None, None]
+            std = self.std[platform].to(cropped)[:, None, None]
+            pixels[i] = (cropped - mean) / std
+            start = end
+        batch["pixels"] = pixels[0] if len(pixels) == 1 else pixels
+
+        if "teacher_features" in batch:
+            variant = hflip.long() + 2 * vflip.long()  # see flip_variant
+            batch["teacher_features"] = batch["teacher_features"][
+                torch.arange(len(variant), device=device), variant
+            ]
+        return batch
 
 
 class ClayDataModule(L.LightningDataModule):
@@ -141,6 +826,22 @@ class ClayDataModule(L.LightningDataModule):
         ],
         batch_size: int = 10,
         num_workers: int = 8,
+        mix_platforms: bool = False,
+        teacher_features_dir: str | None = None,
+        data_format: Literal["npz", "memmap", "shards"] = "npz",
+        shuffle_buffer: int = 64,
+        augment_on_device: bool = False,
+        cache_dir: str = "/tmp/clay-cache",
+        cache_size_gb: float = 100,
+        storage_options: dict | None = None,
+        prefetch_batches: int = 8,
+        manifest_path: str | None = None,
+        seed: int = 0,
+        samples_per_epoch: int | None = None,
+        platform_weights: dict | None = None,
+        temperature: float = 1.0,
+        io_threads: int = 4,
+        chip_filters: dict | None = None,
     ):
         super().__init__()
         self.data_dir = data_dir
@@ -149,49 +850,104 @@ class ClayDataModule(L.LightningDataModule):
         self.metadata = Box(yaml.safe_load(open(metadata_path)))
         self.batch_size = batch_size
         self.num_workers = num_workers
+        self.mix_platforms = mix_platforms
+        self.teacher_features_dir = teacher_features_dir
+        self.data_format = data_format
+        self.shuffle_buffer = shuffle_buffer
+        self.augment_on_device = augment_on_device
+        self.cache = S3ChipCache(
+            cache_dir=cache_dir,
+            max_bytes=int(cache_size_gb * 1024**3),
+            storage_options=storage_options,
+        )
+        self.prefetch_batches = prefetch_batches
+        self.manifest_path = manifest_path
+        self.manifest = None  # loaded once, on the first setup
+        self.augmentation = DeviceAugmentation(size, platforms, self.metadata)
+        self.seed = seed
+        self.samples_per_epoch = samples_per_epoch
+        self.platform_weights = platform_weights
+        self.temperature = temperature
+        self.io_threads = io_threads
+        self.chip_filters = chip_filters
         self.split_ratio = 0.8
+        # Training batches consumed in the epoch, to resume from checkpoints
+        self.consumed_epoch = 0
+        self.batches_consumed = 0
+        self.trn_dl = self.val_dl = None
 
     def setup(self, stage: Literal["fit", "predict"] | None = None) -> None:
-        # Get list of GeoTIFF filepaths from s3 bucket or data/ folder
-        if self.data_dir.startswith("s3://"):
-            dp = torchdata.datapipes.iter.IterableWrapper(iterable=[self.data_dir])
-            chips_path = list(dp.list_files_by_s3(masks="*.npz"))
-        else:  # if self.data_dir is a local data path
-            chips_path = sorted(list(Path(self.data_dir).glob("**/*.npz")))
-            chips_platform = [chip.parent.parent.name for chip in chips_path]
-            # chips_platform = [chip.parent.parent.name for chip in chips_path]
+        self.trn_dl = self.val_dl = None  # dataloaders of the new datasets
+        if self.data_format == "shards" and stage == "fit":
+            self.setup_shards()
+            return
+
+        chips_path = self.list_chips()
         print(f"Total number of chips: {len(chips_path)}")
 
         if stage == "fit":
-            trn_paths, val_paths = train_test_split(
-                chips_path,
-                test_size=(1 - self.split_ratio),
-                stratify=chips_platform,
-                shuffle=True,
-            )
+            trn_paths, val_paths = self.split_chips(chips_path)
 
-            self.trn_ds = EODataset(
+            if self.data_dir.startswith("s3://"):
+                dataset_class = partial(S3EODataset, cache=self.cache)
+            elif self.data_format == "memmap":
+                dataset_class = MemmapEODataset
+            else:
+                dataset_class = EODataset
+            self.trn_ds = dataset_class(
                 chips_path=trn_paths,
                 size=self.size,
                 platforms=self.platforms,
                 metadata=self.metadata,
+                teacher_features_dir=self.teacher_features_dir,
+                augment_on_device=self.augment_on_device,
+                io_threads=self.io_threads,
             )
-            self.trn_sampler = ClaySampler(
-                dataset=self.trn_ds,
-                platforms=self.platforms,
-                batch_size=self.batch_size,
-            )
-            self.val_ds = EODataset(
+            distributed = {
+                "rank": self.trainer.global_rank if self.trainer else 0,
+                "world_size": self.trainer.world_size if self.trainer else 1,
+                "seed": self.seed,
+            }
+            if self.samples_per_epoch is None:
+                self.trn_sampler = ClaySampler(
+                    dataset=self.trn_ds,
+                    platforms=self.platforms,
+                    batch_size=self.batch_size,
+                    mix_platforms=self.mix_platforms,
+                    **distributed,
+                )
+            else:
+                self.trn_sampler = BudgetedClaySampler(
+                    dataset=self.trn_ds,
+                    platforms=self.platforms,
+                    batch_size=self.batch_size,
+                    samples_per_epoch=self.samples_per_epoch,
+                    platform_weights=self.platform_weights,
+                    temperature=self.temperature,
+                    mix_platforms=self.mix_platforms,
+                    **distributed,
+                )
+            self.val_ds = dataset_class(
                 chips_path=val_paths,
                 size=self.size,
                 platforms=self.platforms,
                 metadata=self.metadata,
+                teacher_features_dir=self.teacher_features_dir,
+                augment_on_device=self.augment_on_device,
+                io_threads=self.io_threads,
             )
             self.val_sampler = ClaySampler(
                 dataset=self.val_ds,
                 platforms=self.platforms,
                 batch_size=self.batch_size,
+                mix_platforms=self.mix_platforms,
+                **distributed,
             )
+            if self.data_dir.startswith("s3://"):
+                self.trn_sampler, self.val_sampler = (
+                    PrefetchBatchSampler(sampler, self.cache, self.prefetch_batches)
+                    for sampler in (self.trn_sampler, self.val_sampler)
+                )
 
         elif stage == "predict":
             self.prd_ds = EODataset(
@@ -200,24 +956,191 @@ class ClayDataModule(L.LightningDataModule):
                 metadata_path=self.metadata_path,
             )
 
+    def split_chips(self, chips_path):
+        """
+        Training & validation chips. A chip is in validation when the hash of
+        its `<platform>/<name>` id & the seed falls below `1 - split_ratio`, so
+        the split is the same on every rank & run, every platform splits at
+        the same ratio, & chips keep their side as the dataset grows.
+        """
+        if isinstance(chips_path, ChipManifest):
+            ids = chips_path.chip_ids()
+        else:
+            ids = np.array([chip_id(chip) for chip in chips_path])
+        is_val = hash_fraction(ids, self.seed) < 1 - self.split_ratio
+        trn_idx, val_idx = np.flatnonzero(~is_val), np.flatnonzero(is_val)
+
+        if isinstance(chips_path, ChipManifest):
+            if self.chip_filters:
+                # Filter after the split, so it does not depend on filters
+                keep = chips_path.within(self.chip_filters)
+                platform_indices = chips_path.platform_indices(self.platforms)
+                for platform, indices in platform_indices.items():
+                    if len(indices) > 0 and not keep[indices].any():
+                        raise ValueError(
+                            f"chip_filters keep none of the {len(indices)} chips "
+                            f"of {platform}, loosen them or remove {platform} "
+                            "from data.platforms"
+                        )
+                trn_idx, val_idx = trn_idx[keep[trn_idx]], val_idx[keep[val_idx]]
+                print(f"Chips kept by chip_filters: {keep.sum()}")
+            return chips_path[trn_idx], chips_path[val_idx]
+        if self.chip_filters:
+            raise ValueError(
+                "chip_filters need the quality columns of a chip manifest, "
+                "set data.manifest_path, see scripts/compute_chip_quality.py"
+            )
+        return [chips_path[i] for i in trn_idx], [chips_path[i] for i in val_idx]
+
+    def list_chips(self):
+        """Paths of the chips, or their ChipManifest"""
+        # Get list of GeoTIFF filepaths from s3 bucket or data/ folder
+        if self.data_dir.startswith("s3://"):
+            return [
+                PurePosixPath(key)
+                for key in self.cache.fs.find(self.data_dir)
+                if key.endswith(".npz")
+            ]
+        if self.data_format == "memmap":
+            return memmap_chips_path(self.data_dir)
+        if self.manifest_path is not None:
+            if self.manifest is None:
+                self.manifest = ChipManifest.load(self.manifest_path, self.data_dir)
+            return self.manifest
+        # if self.data_dir is a local data path
+        return sorted(list(Path(self.data_dir).glob("**/*.npz")))
+
+    def setup_shards(self):
+        """Split the shards of every platform between training & validation"""
+        shards_path = sorted(Path(self.data_dir).glob("**/shard-*.bin"))
+        shards_per_platform = defaultdict(list)
+        for shard_path in shards_path:
+            shards_per_platform[shard_path.parent.name].append(shard_path)
+        print(f"Total number of shards: {len(shards_path)}")
+
+        # Same split on every rank, a platform with a single shard only trains
+        rng = np.random.default_rng(self.seed)
+        trn_paths, val_paths = [], []
+        for platform in self.platforms:
+            shards = shards_per_platform[platform]
+            rng.shuffle(shards)
+            num_val = round(len(shards) * (1 - self.split_ratio))
+            num_val = max(min(max(num_val, 1), len(shards) - 1), 0)
+            trn_paths += shards[num_val:]
+            val_paths += shards[:num_val]
+
+        kwargs = {
+            "size": self.size,
+            "platforms": self.platforms,
+            "metadata": self.metadata,
+            "batch_size": self.batch_size,
+            "mix_platforms": self.mix_platforms,
+            "shuffle_buffer": self.shuffle_buffer,
+            "rank": self.trainer.global_rank if self.trainer else 0,
+            "world_size": self.trainer.world_size if self.trainer else 1,
+            "seed": self.seed,
+            "teacher_features_dir": self.teacher_features_dir,
+            "augment_on_device": self.augment_on_device,
+        }
+        self.trn_ds = ShardedEODataset(shards_path=trn_paths, **kwargs)
+        self.val_ds = ShardedEODataset(shards_path=val_paths, **kwargs)
+        self.trn_sampler = self.val_sampler = None
+        # Lightning only sets the epoch of samplers, the datasets get theirs
+        # when their dataloaders are reloaded, see train_dataloader
+        if self.trainer is not None:
+            self.trainer.reload_dataloaders_every_n_epochs = 1
+
+    def resize(self, size, batch_size):
+        """
+        Change the crop size & batch size of the training & validation data in
+        place, see ProgressiveResizing. The datasets share the size with their
+        live dataloader workers & batches are drawn in the main process, so
+        the split & the persistent workers are kept. Takes effect from the next
+        time the dataloaders are iterated.
+        """
+        self.size, self.batch_size = size, batch_size
+        self.augmentation.size = size
+        for dataset in (getattr(self, "trn_ds", None), getattr(self, "val_ds", None)):
+            if dataset is not None:
+                dataset.size = size
+                if isinstance(dataset, ShardedEODataset):
+                    dataset.batch_size = batch_size
+        for sampler in (
+            getattr(self, "trn_sampler", None),
+            getattr(self, "val_sampler", None),
+        ):
+            if sampler is not None:
+                getattr(sampler, "batch_sampler", sampler).batch_size = batch_size
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if self.trainer is not None and self.trainer.training:
+            if self.trainer.current_epoch != self.consumed_epoch:
+                self.consumed_epoch = self.trainer.current_epoch
+                self.batches_consumed = 0
+            self.batches_consumed += 1
+        if self.augment_on_device:
+            batch = self.augmentation(batch)
+        return batch
+
+    def state_dict(self):
+        """
+        Position in the training epoch, saved by Lightning into checkpoints.
+        Ranks consume the same number of batches, see ClaySampler. The batches
+        are counted in the batch size of the epoch, saved along.
+        """
+        return {
+            "seed": self.seed,
+            "epoch": self.consumed_epoch,
+            "batches_consumed": self.batches_consumed,
+            "size": self.size,
+            "batch_size": self.batch_size,
+        }
+
+    def load_state_dict(self, state_dict):
+        """Resume the training epoch at the first batch not consumed yet"""
+        self.consumed_epoch = state_dict["epoch"]
+        self.batches_consumed = state_dict["batches_consumed"]
+        if "size" in state_dict:
+            self.resize(state_dict["size"], state_dict["batch_size"])
+        if getattr(self, "trn_sampler", None) is not None:
+            self.trn_sampler.load_state_dict(state_dict)
+
     def train_dataloader(self):
-        return DataLoader(
-            self.trn_ds,
-            num_workers=self.num_workers,
-            batch_sampler=self.trn_sampler,
-            collate_fn=batch_collate,
-            pin_memory=True,
-            prefetch_factor=4,
-        )
+        # The same dataloader every epoch, keeping its workers when resizing
+        if self.trn_dl is None:
+            self.trn_dl = self.dataloader(self.trn_ds, self.trn_sampler)
+        if isinstance(self.trn_ds, ShardedEODataset) and self.trainer is not None:
+            self.trn_ds.set_epoch(self.trainer.current_epoch)
+        return self.trn_dl
 
     def val_dataloader(self):
+        if isinstance(self.val_ds, ShardedEODataset) and self.trainer is not None:
+            self.val_ds.set_epoch(self.trainer.current_epoch)
+        if self.val_dl is None:
+            self.val_dl = self.dataloader(self.val_ds, self.val_sampler)
+        return self.val_dl
+
+    def dataloader(self, dataset, batch_sampler):
+        # Persistent workers keep their seed across epochs: they continue their
+        # random crops, & the epoch of a ShardedEODataset, shared with them,
+        # seeds its order, see setup_shards
+        if self.data_format == "shards":
+            return DataLoader(
+                dataset,
+                batch_size=None,
+                num_workers=self.num_workers,
+                pin_memory=True,
+                prefetch_factor=4,
+                persistent_workers=self.num_workers > 0,
+            )
         return DataLoader(
-            self.val_ds,
+            dataset,
             num_workers=self.num_workers,
-            batch_sampler=self.val_sampler,
+            batch_sampler=batch_sampler,
             collate_fn=batch_collate,
             pin_memory=True,
             prefetch_factor=4,
+            persistent_workers=self.num_workers > 0,
         )
 
     def predict_dataloader(self):
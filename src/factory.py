@@ -8,6 +8,7 @@ import torch
 import torch.nn.functional as F
 from einops import rearrange
 from torch import nn
+from torch._dynamo import is_compiling
 
 from src.utils import posemb_sincos_1d
 
@@ -74,6 +75,7 @@ class DynamicEmbedding(nn.Module):
         patch_size,
         embed_dim,
         is_decoder=False,
+        cache_kernels=False,
     ):
         super().__init__()
         self.wave_dim = wave_dim
@@ -92,11 +94,18 @@ class DynamicEmbedding(nn.Module):
         )
         self.fclayer = FCBlock(self.wave_dim)
 
+        # Generated kernels per wavelength set, only used when the generator
+        # weights can not change between calls (inference or frozen weights).
+        self.cache_kernels = cache_kernels
+        self.kernel_cache = {}
+        self.register_load_state_dict_post_hook(self.clear_cache_hook)
+
         self.initialize_weights()
 
-    def forward(self, batch, waves):
+    def generate_kernel(self, waves, device):
+        """Generate the patch embedding weight & bias for a set of wavelengths"""
         waves = posemb_sincos_1d(waves, self.wave_dim)
-        waves = waves.to(batch.device)
+        waves = waves.to(device)
         waves = self.fclayer(waves)
         weight, bias = self.weight_generator(waves)
 
@@ -108,10 +117,6 @@ class DynamicEmbedding(nn.Module):
                 k2=self.patch_size,
                 cout=self.embed_dim,
             )
-            if bias is not None:
-                bias = rearrange(bias, "b -> (b)")
-            dynamic_out = F.linear(batch, dynamic_weight * 0.02, bias=bias)
-            x = dynamic_out
         else:
             dynamic_weight = rearrange(
                 weight,
@@ -119,10 +124,71 @@ class DynamicEmbedding(nn.Module):
                 k1=self.patch_size,
                 k2=self.patch_size,
             )
-            if bias is not None:
-                bias = rearrange(bias, "b -> (b)")
+        if bias is not None:
+            bias = rearrange(bias, "b -> (b)")
+
+        return dynamic_weight * 0.02, bias, waves
+
+    def get_kernel(self, waves, device, dtype):
+        """
+        Return the patch embedding weight & bias for a set of wavelengths,
+        reusing a cached copy when kernel caching is enabled & no gradient
+        has to flow into the weight generator.
+        """
+        if not self.cache_kernels or (
+            torch.is_grad_enabled()
+            and any(param.requires_grad for param in self.parameters())
+        ):
+            return self.generate_kernel(waves, device)
+
+        key = (tuple(waves.tolist()), str(device), dtype)
+        if key not in self.kernel_cache:
+            with torch.no_grad():
+                weight, bias, waves = self.generate_kernel(waves, device)
+            self.kernel_cache[key] = (
+                weight.to(dtype),
+                None if bias is None else bias.to(dtype),
+                waves,
+            )
+        return self.kernel_cache[key]
+
+    def clear_cache(self):
+        """Drop all cached kernels, call whenever the weights change"""
+        self.kernel_cache.clear()
+
+    @staticmethod
+    def clear_cache_hook(module, incompatible_keys):
+        module.clear_cache()
+
+    def train(self, mode=True):
+        # Weights are about to be updated, cached kernels would go stale
+        if mode:
+            self.clear_cache()
+        return super().train(mode)
+
+    def forward(self, batch, waves):
+        dynamic_weight, bias, waves = self.get_kernel(waves, batch.device, batch.dtype)
+
+        if self.is_decoder:
+            dynamic_out = F.linear(batch, dynamic_weight, bias=bias)
+            x = dynamic_out
+        elif is_compiling():
+            # Same as the conv2d below as a matmul over the flattened patches,
+            # inductor would specialize the convolution on band count & size
+            patches = rearrange(
+                batch,
+                "b c (h p1) (w p2) -> b (h w) (c p1 p2)",
+                p1=self.patch_size,
+                p2=self.patch_size,
+            )
+            x = F.linear(
+                patches,
+                rearrange(dynamic_weight, "cout c p1 p2 -> cout (c p1 p2)"),
+                bias,
+            )
+        else:
             dynamic_out = F.conv2d(
-                batch, dynamic_weight * 0.02, bias=bias, stride=self.patch_size
+                batch, dynamic_weight, bias=bias, stride=self.patch_size
             )
             x = rearrange(dynamic_out, "b c h w -> b (h w) c")
 
@@ -0,0 +1,94 @@
+"""
+Fully sharded data parallel (FSDP) training for ClayMAE.
+
+Every transformer block of the encoder & decoder is its own FSDP unit, so only
+one block at a time is gathered in full. The frozen teacher is wrapped as a
+single unsharded unit, it gets no gradients or optimizer state & would only add
+all-gathers to every step. The remaining parameters (patch embeddings, tokens &
+projection) are sharded with the root unit.
+
+Use it from the command line with the `configs/fsdp.yaml` overlay:
+
+    python trainer.py fit --config configs/config.yaml --config configs/fsdp.yaml
+"""
+
+from pathlib import Path
+
+import torch
+import torch.distributed.checkpoint as dcp
+from lightning.pytorch.strategies import FSDPStrategy
+from torch.distributed.checkpoint.metadata import TensorStorageMetadata
+from torch.distributed.fsdp import FullyShardedDataParallel, ShardingStrategy
+from torch.distributed.fsdp.wrap import CustomPolicy
+
+from src.transformer import TransformerBlock
+
+
+class ClayFSDPStrategy(FSDPStrategy):
+    """
+    FSDPStrategy with the ClayMAE wrapping policy. Checkpoints are saved
+    sharded by default, one file per rank in a checkpoint directory, which
+    `load_checkpoint` consolidates for the finetune factories.
+    """
+
+    def __init__(self, state_dict_type="sharded", **kwargs):
+        kwargs.setdefault("auto_wrap_policy", CustomPolicy(self.wrap_policy))
+        super().__init__(state_dict_type=state_dict_type, **kwargs)
+
+    def wrap_policy(self, module):
+        if isinstance(module, TransformerBlock):
+            return True
+        if module is getattr(self.lightning_module.model, "teacher", None):
+            return {"sharding_strategy": ShardingStrategy.NO_SHARD}
+        return False
+
+    def _setup_model(self, model):
+        """
+        Overrides the private `FSDPStrategy._setup_model` of Lightning 2.1, as
+        pinned in environment.yml, to wrap CPU runs itself. Lightning passes
+        the index of the root device as `device_id`, None on CPU. The method
+        is unchanged up to Lightning 2.6, check it again when upgrading.
+        """
+        if self.root_device.type == "cpu" and not isinstance(
+            model, FullyShardedDataParallel
+        ):
+            # Without a device_id FSDP looks for an accelerator, pin CPU runs
+            # (gloo backend) to the CPU
+            model = FullyShardedDataParallel(
+                module=model,
+                cpu_offload=self.cpu_offload,
+                mixed_precision=self.mixed_precision_config,
+                sharding_strategy=self.sharding_strategy,
+                device_id=self.root_device,
+                **self.kwargs,
+            )
+            self.kwargs.pop("auto_wrap_policy", None)
+        return super()._setup_model(model)
+
+
+def load_checkpoint(ckpt_path, map_location=None):
+    """
+    Load a ClayMAEModule checkpoint, either a single file or the directory of
+    shards written by ClayFSDPStrategy. Shards are consolidated into a full
+    `state_dict` in CPU memory, the optimizer states are skipped.
+    """
+    ckpt_path = Path(ckpt_path)
+    if not ckpt_path.is_dir():
+        return torch.load(ckpt_path, map_location=map_location)
+
+    reader = dcp.FileSystemReader(ckpt_path)
+    state_dict = {
+        name: torch.empty(meta.size, dtype=meta.properties.dtype)
+        for name, meta in reader.read_metadata().state_dict_metadata.items()
+        if name.startswith("model.") and isinstance(meta, TensorStorageMetadata)
+    }
+    if hasattr(dcp, "load"):
+        dcp.load(state_dict, storage_reader=reader, no_dist=True)
+    else:  # torch 2.1, as pinned in environment.yml
+        dcp.load_state_dict(state_dict, reader, no_dist=True)
+
+    ckpt = torch.load(ckpt_path / "meta.pt", map_location="cpu")
+    ckpt["state_dict"] = {
+        name.removeprefix("model."): param for name, param in state_dict.items()
+    }
+    return ckpt
@@ -0,0 +1,191 @@
+"""
+Manifest of the npz chips of a data directory, so that ClayDataModule does not
+list & stat millions of files every time it is set up.
+
+The manifest is a npz file of columnar arrays with one row per chip: the index
+of its directory in the `dirs` table (`dir`), its file `name`, the index of its
+platform in the `platforms` table (`platform`), the `shape` [b2 C H W] of its
+pixels, its size in bytes (`nbytes`) & its modification time (`mtime`). Any
+other column, e.g. quality scores, is carried along as is.
+
+Build it, or update it when new chips arrive, with `scripts/build_manifest.py`.
+"""
+
+import zipfile
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+READ_ARRAY_HEADER = {
+    (1, 0): np.lib.format.read_array_header_1_0,
+    (2, 0): np.lib.format.read_array_header_2_0,
+}
+FNV_OFFSET, FNV_PRIME = np.uint64(0xCBF29CE484222325), np.uint64(0x100000001B3)
+
+
+class ChipManifest:
+    """
+    Chips of a manifest, indexable like a list of chip paths. Indexing with an
+    array of indices returns the manifest of these chips.
+    """
+
+    def __init__(self, data_dir, dirs, platforms, columns):
+        self.data_dir = Path(data_dir)
+        self.dirs = dirs
+        self.platforms = platforms
+        self.columns = columns
+
+    @classmethod
+    def load(cls, manifest_path, data_dir):
+        with np.load(manifest_path, allow_pickle=False) as manifest:
+            columns = dict(manifest)
+        return cls(data_dir, columns.pop("dirs"), columns.pop("platforms"), columns)
+
+    def save(self, manifest_path):
+        np.savez(
+            manifest_path, dirs=self.dirs, platforms=self.platforms, **self.columns
+        )
+
+    def __len__(self):
+        return len(self.columns["name"])
+
+    def __getitem__(self, idx):
+        if np.ndim(idx):
+            columns = {key: column[idx] for key, column in self.columns.items()}
+            return ChipManifest(self.data_dir, self.dirs, self.platforms, columns)
+        chip_dir = self.dirs[self.columns["dir"][idx]]
+        return self.data_dir / chip_dir / self.columns["name"][idx].decode()
+
+    def relative_paths(self):
+        return [
+            f"{self.dirs[chip_dir]}/{name.decode()}"
+            for chip_dir, name in zip(self.columns["dir"], self.columns["name"])
+        ]
+
+    def chip_ids(self):
+        """Stable `<platform>/<name>` ids of the chips, as bytes"""
+        platforms = np.char.add(self.platforms.astype(bytes), b"/")
+        return np.char.add(platforms[self.columns["platform"]], self.columns["name"])
+
+    def within(self, bounds):
+        """
+        Mask of the chips whose columns are within `bounds`, a dict of column
+        to `[low, high]`, with None for no bound. Unset values (nan) pass, so
+        chips added since the columns were computed are kept.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, (low, high) in bounds.items():
+            values = self.columns[column]
+            if low is not None:
+                mask &= ~(values < low)
+            if high is not None:
+                mask &= ~(values > high)
+        return mask
+
+    def platform_indices(self, platforms):
+        """Indices of the chips of every platform"""
+        codes = {platform: code for code, platform in enumerate(self.platforms)}
+        return {
+            platform: np.flatnonzero(
+                self.columns["platform"] == codes.get(platform, -1)
+            )
+            for platform in platforms
+        }
+
+
+def chip_id(chip_path):
+    """Stable `<platform>/<name>` id of a chip, as bytes, see ChipManifest"""
+    return f"{chip_path.parent.name}/{chip_path.name}".encode()
+
+
+def hash_fraction(ids, seed=0):
+    """
+    Uniform value in [0, 1) of every chip id, a pure function of the id & the
+    seed, vectorized over the ids: the FNV-1a hash of the bytes of
+    `<seed>/<id>`, skipping the padding of the array, mixed with the
+    finalizer of MurmurHash3.
+    """
+    hashes = np.full(len(ids), FNV_OFFSET)
+    for code in f"{seed}/".encode():
+        hashes = (hashes ^ np.uint64(code)) * FNV_PRIME
+    ids = np.asarray(ids, dtype=bytes)
+    codes = np.frombuffer(ids.tobytes(), dtype=np.uint8).reshape(len(ids), -1)
+    for code in np.ascontiguousarray(codes.T):
+        np.multiply(hashes ^ code, FNV_PRIME, out=hashes, where=code > 0)
+    for factor in (0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53):
+        hashes ^= hashes >> np.uint64(33)
+        hashes *= np.uint64(factor)
+    hashes ^= hashes >> np.uint64(33)
+    return (hashes >> np.uint64(11)).astype(np.float64) / 2**53
+
+
+def list_chips(chip_dir):
+    """Path, size in bytes & modification time of the chips of a directory"""
+    chips = []
+    for chip_path in sorted(chip_dir.glob("*.npz")):
+        stat = chip_path.stat()
+        chips.append((chip_path, stat.st_size, stat.st_mtime))
+    return chips
+
+
+def read_shape(chip_path):
+    """Shape of the pixels of a chip file, from the npy header only"""
+    with zipfile.ZipFile(chip_path) as archive, archive.open("pixels.npy") as f:
+        shape, *_ = READ_ARRAY_HEADER[np.lib.format.read_magic(f)](f)
+    return shape
+
+
+def build_manifest(data_dir, previous=None, workers=8):
+    """
+    List the chips of `data_dir` into a ChipManifest, in parallel. Only the
+    chips which are new or changed since the `previous` manifest are read, the
+    rows of the other chips are reused, extra columns included.
+    """
+    data_dir = Path(data_dir)
+    chip_dirs = sorted({data_dir, *data_dir.glob("**/")})
+    with Pool(workers) as pool:
+        chips = [chip for chips in pool.map(list_chips, chip_dirs) for chip in chips]
+
+        # Row of every unchanged chip in the previous manifest, -1 otherwise
+        paths = [chip_path.relative_to(data_dir).as_posix() for chip_path, *_ in chips]
+        reused = np.full(len(chips), -1, dtype=np.int64)
+        if previous is not None:
+            rows = {path: row for row, path in enumerate(previous.relative_paths())}
+            for i, (path, (_, nbytes, mtime)) in enumerate(zip(paths, chips)):
+                row = rows.get(path)
+                if row is not None and (
+                    previous.columns["nbytes"][row] == nbytes
+                    and previous.columns["mtime"][row] == mtime
+                ):
+                    reused[i] = row
+        changed = np.flatnonzero(reused < 0)
+        shapes = pool.map(read_shape, [chips[i][0] for i in changed], chunksize=64)
+
+    dirs, dir_codes = np.unique(
+        [path.rpartition("/")[0] for path in paths], return_inverse=True
+    )
+    platforms, platform_codes = np.unique(
+        [chip_path.parent.name for chip_path, *_ in chips], return_inverse=True
+    )
+    columns = {
+        "dir": dir_codes.astype(np.int32),
+        "name": np.array([chip_path.name.encode() for chip_path, *_ in chips]),
+        "platform": platform_codes.astype(np.int16),
+        "shape": np.zeros((len(chips), 4), dtype=np.int32),
+        "nbytes": np.array([nbytes for _, nbytes, _ in chips], dtype=np.int64),
+        "mtime": np.array([mtime for *_, mtime in chips], dtype=np.float64),
+    }
+    if len(changed):
+        columns["shape"][changed] = shapes
+    if previous is not None:
+        for key, column in previous.columns.items():
+            if key in ("dir", "name", "platform", "nbytes", "mtime"):
+                continue
+            if key not in columns:  # extra columns of new chips are unset
+                fill = np.nan if np.issubdtype(column.dtype, np.floating) else 0
+                columns[key] = np.full(
+                    (len(chips), *column.shape[1:]), fill, dtype=column.dtype
+                )
+            columns[key][reused >= 0] = column[reused[reused >= 0]]
+    return ChipManifest(data_dir, dirs, platforms, columns)
@@ -1,3 +1,5 @@
+import copy
+import itertools
 import math
 import os
 from typing import Literal
@@ -8,18 +10,61 @@ import torch
 import torch.nn.functional as F
 import yaml
 from box import Box
-from einops import rearrange, reduce, repeat
+from einops import rearrange, reduce
 from torch import nn
+from torch._dynamo import is_compiling
 from torchvision.transforms import v2
-from vit_pytorch.simple_vit import Transformer
 
 from src.factory import DynamicEmbedding
-from src.utils import posemb_sincos_2d_with_gsd
+from src.transformer import ATTENTION_BACKENDS, Transformer
+from src.utils import cached_posemb_sincos_2d_with_gsd, posemb_sincos_2d_with_gsd
+
+TEACHER_CHIP_SIZE = 224
 
 torch.set_float32_matmul_precision("medium")
 os.environ["TORCH_CUDNN_V8_API_DISABLED"] = "1"
 
 
+def pos_metadata_tables(grid_size, dim, gsd, time, latlon, device):  # noqa: PLR0913
+    """
+    Positional & GSD encoding plus the time & latlon metadata, zero padded to
+    `dim` so that both broadcast against patches of shape [B L dim]. The
+    padded positional table is memoized on the device & shared by Encoder &
+    Decoder, it must not be modified in place.
+
+    Returns
+    -------
+    pos_encoding : torch.Tensor
+        A tensor of shape (L, dim), or (B, L, dim) for a gsd per sample.
+    time_latlon : torch.Tensor
+        A tensor of shape (B, 1, dim).
+    """
+    gsd = torch.as_tensor(gsd)
+    if is_compiling():  # Traced into the graph, gsd stays a tensor input
+        pos_encoding = posemb_sincos_2d_with_gsd(
+            h=grid_size, w=grid_size, dim=(dim - 8), gsd=gsd
+        ).to(device)  # [L (D - 8)] or [B L (D - 8)]
+        pos_encoding = F.pad(pos_encoding, (0, 8))  # [... L D]
+    elif gsd.ndim == 0:
+        pos_encoding = cached_posemb_sincos_2d_with_gsd(
+            grid_size, grid_size, dim - 8, float(gsd), torch.float32, device, pad=8
+        )  # [L D], memoized padded
+    else:
+        gsd_values, gsd_indices = torch.unique(gsd, return_inverse=True)
+        pos_encoding = torch.stack(
+            [
+                cached_posemb_sincos_2d_with_gsd(
+                    grid_size, grid_size, dim - 8, value, torch.float32, device, pad=8
+                )
+                for value in gsd_values.tolist()
+            ]
+        )[gsd_indices.to(device)]  # [B L D]
+
+    time_latlon = torch.hstack((time, latlon)).to(device).detach()  # [B 8]
+    time_latlon = F.pad(time_latlon, (dim - 8, 0))[:, None, :]  # [B 1 D]
+    return pos_encoding, time_latlon
+
+
 class Encoder(nn.Module):
     def __init__(  # noqa: PLR0913
         self,
@@ -31,6 +76,9 @@ class Encoder(nn.Module):
         heads,
         dim_head,
         mlp_ratio,
+        attention_backend="auto",
+        checkpoint_layers=None,
+        cache_kernels=False,
     ):
         super().__init__()
         self.mask_ratio = mask_ratio
@@ -45,6 +93,7 @@ class Encoder(nn.Module):
             patch_size=patch_size,
             embed_dim=dim,
             is_decoder=False,
+            cache_kernels=cache_kernels,
         )
 
         self.transformer = Transformer(
@@ -53,10 +102,23 @@ class Encoder(nn.Module):
             heads=heads,
             dim_head=dim_head,
             mlp_dim=int(dim * mlp_ratio),
+            attention_backend=attention_backend,
+            checkpoint_layers=checkpoint_layers,
         )
 
     def to_patch_embed(self, cube, waves):
-        """Split the input cube into patches & create embeddings per patch"""
+        """
+        Split the input cube into patches & create embeddings per patch.
+
+        For batches mixing platforms, cube & waves are lists with one entry
+        per platform, the patches are concatenated along the batch dimension.
+        """
+        if isinstance(cube, (list, tuple)):
+            patches, waves_encoded = zip(
+                *(self.patch_embedding(c, w) for c, w in zip(cube, waves))
+            )
+            return torch.cat(patches, dim=0), list(waves_encoded)
+
         patches, waves_encoded = self.patch_embedding(cube, waves)  # [B L D]
         return patches, waves_encoded  # ([B L D], [N D])
 
@@ -65,28 +127,13 @@ class Encoder(nn.Module):
         B, L, D = patches.shape
 
         grid_size = int(math.sqrt(L))
-        self.num_patches = grid_size**2
-
-        pos_encoding = (
-            posemb_sincos_2d_with_gsd(
-                h=grid_size,
-                w=grid_size,
-                dim=(self.dim - 8),
-                gsd=gsd,
-            )
-            .to(patches.device)
-            .detach()
-        )  # [L (D - 8)]
 
-        time_latlon = torch.hstack((time, latlon)).to(patches.device).detach()  # [B 8]
+        pos_encoding, time_latlon = pos_metadata_tables(
+            grid_size, self.dim, gsd, time, latlon, patches.device
+        )  # [L D] or [B L D] for a gsd per sample, [B 1 D]
 
-        pos_encoding = repeat(pos_encoding, "L D -> B L D", B=B)  # [B L (D - 8)]
-        time_latlon = repeat(time_latlon, "B D -> B L D", L=L)  # [B L 8]
-        pos_metadata_encoding = torch.cat(
-            (pos_encoding, time_latlon), dim=-1
-        )  # [B L D]
-
-        patches = patches + pos_metadata_encoding  # [B L D] + [B L D] -> [B L D]
+        # Broadcast the encodings instead of materializing them per sample
+        patches = (patches + pos_encoding).add_(time_latlon)  # [B L D]
         return patches  # [B L D]
 
     def mask_out(self, patches):
@@ -110,13 +157,10 @@ class Encoder(nn.Module):
             A tensor of shape (B, mask_ratio) containing the indices of the
             masked patches.
         masked_matrix : torch.Tensor
-            A tensor of shape (B, L) containing the mask matrix, 1 indicates a masked
-            patch & 0 indicates an unmasked patch.
+            A boolean tensor of shape (B, L) containing the mask matrix, True
+            indicates a masked patch & False indicates an unmasked patch.
         """
         B, L, D = patches.shape
-        # assert (
-        #     L == self.num_patches
-        # ), f"Expected {self.num_patches} patches, got {L} patches."
 
         if self.shuffle:  # Shuffle the patches
             noise = torch.randn((B, L), device=patches.device)  # [B L]
@@ -129,20 +173,16 @@ class Encoder(nn.Module):
         reverse_indices = torch.argsort(random_indices, dim=-1)  # [B L]
 
         num_masked_patches = int(
-            self.mask_ratio * self.num_patches
+            self.mask_ratio * L
         )  # Number of patches to be masked out
         masked_indices, unmasked_indices = (
             random_indices[:, :num_masked_patches],  # [B mask_ratio * L]
             random_indices[:, num_masked_patches:],  # [B (1 - mask_ratio) * L]
         )
 
-        # create a mask of shape B L, where 1 indicates a masked patch
-        # and 0 indicates an unmasked patch
-        masked_matrix = torch.zeros((B, L), device=patches.device)  # [B L] = 0
-        masked_matrix[:, :num_masked_patches] = 1  # [B mask_ratio * L] = 1
-        masked_matrix = torch.gather(
-            masked_matrix, dim=1, index=reverse_indices
-        )  # [B L] -> [B L] - reorder the patches
+        # create a mask of shape B L, where True indicates a masked patch,
+        # i.e. a patch that lands in the first N patches after shuffling
+        masked_matrix = reverse_indices < num_masked_patches  # [B L]
 
         # mask out the patches
         batch_indices = rearrange(
@@ -151,7 +191,6 @@ class Encoder(nn.Module):
         unmasked_patches = patches[
             batch_indices, unmasked_indices, :
         ]  # [B L:(1 - mask_ratio) D]
-        _ = patches[batch_indices, masked_indices, :]  # [B L:mask_ratio D]
 
         return (
             unmasked_patches,
@@ -162,18 +201,17 @@ class Encoder(nn.Module):
 
     def forward(self, datacube):
         cube, time, latlon, gsd, waves = (
-            datacube["pixels"],  # [B C H W]
+            datacube["pixels"],  # [B C H W] or list of [B' C' H W] per platform
             datacube["time"],  # [B 2]
             datacube["latlon"],  # [B 2]
-            datacube["gsd"],  # 1
-            datacube["waves"],  # [N]
+            datacube["gsd"],  # 1 or [B]
+            datacube["waves"],  # [N] or list of [N'] per platform
         )  # [B C H W]
 
-        B, C, H, W = cube.shape
-
         patches, waves_encoded = self.to_patch_embed(
             cube, waves
         )  # [B L D] - patchify & create embeddings per patch
+        B = patches.shape[0]
         # TODO: Add time & latlon as encoding to patches
         patches = self.add_encodings(
             patches,
@@ -193,7 +231,7 @@ class Encoder(nn.Module):
         )  # [B L:(1 - mask_ratio) D], [(1-mask_ratio)], [mask_ratio], [B L]
 
         # Add class tokens
-        cls_tokens = repeat(self.cls_token, "1 1 D -> B 1 D", B=B)  # [B 1 D]
+        cls_tokens = self.cls_token.expand(B, -1, -1)  # [B 1 D]
         unmasked_patches = torch.cat(
             (cls_tokens, unmasked_patches), dim=1
         )  # [B (1 + L) D]
@@ -210,6 +248,105 @@ class Encoder(nn.Module):
             masked_matrix,
         )  # [B ((1 + L):(1 - mask_ratio)) D], [(1-mask_ratio)], [mask_ratio], [B L]
 
+    def specialize(self, waves, gsd, chip_size):
+        """
+        Fold the encoder into a plain module for a single sensor & chip size.
+
+        The dynamic patch embedding is replaced by a static nn.Conv2d built
+        from the generated weights, and the positional & GSD encoding is
+        precomputed into a buffer. Patches are never masked.
+
+        Parameters
+        ----------
+        waves : torch.Tensor
+            A tensor of shape (N,) with the wavelengths of the sensor bands.
+        gsd : float
+            Ground sampling distance of the sensor.
+        chip_size : int
+            Height & width of the input chips, a multiple of the patch size.
+
+        Returns
+        -------
+        SpecializedEncoder
+            A module mapping pixels, time & latlon to the encoded patches.
+        """
+        assert chip_size % self.patch_size == 0, "chip_size must fit the patches"
+        waves = torch.as_tensor(waves, dtype=torch.float32)
+        device = self.cls_token.device
+
+        with torch.no_grad():
+            weight, bias, _ = self.patch_embedding.generate_kernel(waves, device)
+        patch_embedding = nn.Conv2d(
+            in_channels=len(waves),
+            out_channels=self.dim,
+            kernel_size=self.patch_size,
+            stride=self.patch_size,
+            bias=bias is not None,
+        )
+        patch_embedding.weight.data.copy_(weight)
+        if bias is not None:
+            patch_embedding.bias.data.copy_(bias)
+
+        grid_size = chip_size // self.patch_size
+        pos_encoding = posemb_sincos_2d_with_gsd(
+            h=grid_size,
+            w=grid_size,
+            dim=(self.dim - 8),
+            gsd=gsd,
+        )  # [L (D - 8)]
+
+        return SpecializedEncoder(
+            patch_embedding=patch_embedding,
+            pos_encoding=pos_encoding,
+            cls_token=self.cls_token.detach().clone(),
+            transformer=copy.deepcopy(self.transformer),
+        ).to(device)
+
+
+class SpecializedEncoder(nn.Module):
+    """
+    Clay Encoder fixed to one sensor, created with `Encoder.specialize`.
+
+    Has no hypernetwork & no python side metadata, which keeps the forward
+    pass friendly to tracing & export.
+    """
+
+    def __init__(self, patch_embedding, pos_encoding, cls_token, transformer):
+        super().__init__()
+        self.patch_embedding = patch_embedding
+        self.register_buffer("pos_encoding", pos_encoding)  # [L (D - 8)]
+        self.cls_token = nn.Parameter(cls_token)
+        self.transformer = transformer
+
+    def forward(self, cube, time, latlon):
+        """
+        cube: [B C H W]
+        time: [B 4]
+        latlon: [B 4]
+
+        Returns the encoded patches of shape [B (1 + L) D], cls token first.
+        """
+        B = cube.shape[0]
+
+        patches = self.patch_embedding(cube)  # [B D h w]
+        patches = rearrange(patches, "B D h w -> B (h w) D")  # [B L D]
+        L = patches.shape[1]
+
+        time_latlon = torch.hstack((time, latlon))  # [B 8]
+        pos_metadata_encoding = torch.cat(
+            (
+                self.pos_encoding.expand(B, -1, -1),  # [B L (D - 8)]
+                time_latlon[:, None, :].expand(-1, L, -1),  # [B L 8]
+            ),
+            dim=-1,
+        )  # [B L D]
+        patches = patches + pos_metadata_encoding  # [B L D]
+
+        cls_tokens = self.cls_token.expand(B, -1, -1)  # [B 1 D]
+        patches = torch.cat((cls_tokens, patches), dim=1)  # [B (1 + L) D]
+
+        return self.transformer(patches)  # [B (1 + L) D]
+
 
 class Decoder(nn.Module):
     def __init__(  # noqa: PLR0913
@@ -222,6 +359,9 @@ class Decoder(nn.Module):
         heads,
         dim_head,
         mlp_ratio,
+        attention_backend="auto",
+        checkpoint_layers=None,
+        cache_kernels=False,
     ):
         super().__init__()
         self.mask_ratio = mask_ratio
@@ -239,6 +379,8 @@ class Decoder(nn.Module):
             heads=heads,
             dim_head=dim_head,
             mlp_dim=int(dim * mlp_ratio),
+            attention_backend=attention_backend,
+            checkpoint_layers=checkpoint_layers,
         )
         self.embed_to_pixels = DynamicEmbedding(
             wave_dim=128,
@@ -246,6 +388,7 @@ class Decoder(nn.Module):
             patch_size=patch_size,
             embed_dim=dim,
             is_decoder=True,
+            cache_kernels=cache_kernels,
         )
 
     def reconstruct_and_add_encoding(  # noqa: PLR0913
@@ -260,60 +403,33 @@ class Decoder(nn.Module):
     ):
         B, L = masked_matrix.shape
         grid_size = int(math.sqrt(L))
-        self.num_patches = grid_size**2
-        cls_tokens, unmasked_patches = (
-            unmasked_patches[:, :1, :],
-            unmasked_patches[:, 1:, :],
-        )  # [B 1 D], [B L:(1 - mask_ratio) D]
-
-        pos_encoding = (
-            posemb_sincos_2d_with_gsd(
-                h=grid_size, w=grid_size, dim=(self.dim - 8), gsd=gsd
-            )
-            .to(unmasked_patches.device)
-            .detach()
-        )  # [L D]
-        time_latlon = (
-            torch.hstack((time, latlon)).to(unmasked_patches.device).detach()
-        )  # [B 8]
-
-        pos_encoding = repeat(pos_encoding, "L D -> B L D", B=B)  # [B L (D - 8)]
-        time_latlon = repeat(time_latlon, "B D -> B L D", L=L)  # [B L 8]
-        pos_metadata_encoding = torch.cat(
-            (pos_encoding, time_latlon), dim=-1
-        )  # [B L D]
+        num_masked_patches = int(self.mask_ratio * L)
+
+        pos_encoding, time_latlon = pos_metadata_tables(
+            grid_size, self.dim, gsd, time, latlon, unmasked_patches.device
+        )  # [L D] or [B L D] for a gsd per sample, [B 1 D]
+
+        # Append the mask tokens to the class token & unmasked patches, this
+        # is the shuffled order of the patches
+        decoder_patches = torch.cat(
+            (unmasked_patches, self.mask_patch.expand(B, num_masked_patches, -1)),
+            dim=1,
+        )  # [B (1 + L) D]
 
+        # Unshuffle the patches by indexing, the class token stays first
+        shuffled_indices = torch.cat((unmasked_indices, masked_indices), dim=1)
+        unshuffle_indices = F.pad(
+            torch.argsort(shuffled_indices, dim=-1) + 1, (1, 0)
+        )  # [B (1 + L)]
         batch_indices = rearrange(
             torch.arange(B, device=unmasked_patches.device), "B -> B 1"
         )  # [B 1]
+        decoder_patches = decoder_patches[
+            batch_indices, unshuffle_indices, :
+        ]  # [B (1 + L) D]
 
-        num_masked_patches = int(self.mask_ratio * self.num_patches)
-        masked_patches = repeat(
-            self.mask_patch, "D -> B L D", B=B, L=num_masked_patches
-        )  # [B L:mask_ratio D]
-
-        # Add position encoding
-        masked_patches = (
-            masked_patches + pos_metadata_encoding[batch_indices, masked_indices, :]
-        )  # [B L:mask_ratio D] + [B L:mask_ratio D]
-        unmasked_patches = (
-            unmasked_patches + pos_metadata_encoding[batch_indices, unmasked_indices, :]
-        )  # [B GL:(1 - masked_ratio) D] + [B GL:(1 - mask_ratio) D]
-
-        # Concatenate the masked & unmasked patches
-        decoder_patches = torch.zeros(
-            (B, self.num_patches, self.dim), device=unmasked_patches.device
-        )  # [B L D]
-        decoder_patches[batch_indices, unmasked_indices, :] = (
-            unmasked_patches  # [B L:(1 - mask_ratio) D])
-        )
-        decoder_patches[batch_indices, masked_indices, :] = (
-            masked_patches  # [B L:mask_ratio D])
-        )
-
-        decoder_patches = torch.cat(
-            (cls_tokens, decoder_patches), dim=1
-        )  # [B (1 + L) D]
+        # Add position encoding to the patches, not to the class token
+        decoder_patches[:, 1:, :].add_(pos_encoding).add_(time_latlon)
 
         return decoder_patches  # [B (1 + L) D]
 
@@ -327,7 +443,13 @@ class Decoder(nn.Module):
         latlon,
         gsd,
         waves,
+        group_sizes=None,
     ):
+        """
+        For batches mixing platforms, waves is a list with one entry per
+        platform & group_sizes holds the number of samples of each platform.
+        The reconstructed pixels are then returned as a list per platform too.
+        """
         # Change the embedding dimension from encoder to decoder
         encoded_unmasked_patches = self.enc_to_dec(
             encoded_unmasked_patches
@@ -347,6 +469,19 @@ class Decoder(nn.Module):
         # Pass the decoder patches through the transformer
         decoded_patches = self.transformer(decoder_patches)  # [B (1 + L) D]
 
+        if isinstance(waves, (list, tuple)):
+            pixels, waves = zip(
+                *(
+                    self.embed_to_pixels(group, w)
+                    for group, w in zip(
+                        decoded_patches.split(group_sizes, dim=0), waves
+                    )
+                )
+            )
+            # Remove the class token
+            pixels = [p[:, 1:, :] for p in pixels]
+            return pixels, list(waves)  # list of [B' L (C' P P)], [B' N']
+
         pixels, waves = self.embed_to_pixels(
             decoded_patches, waves
         )  # [B (1 + L) (C P P)]
@@ -355,6 +490,17 @@ class Decoder(nn.Module):
         return pixels, waves  # [B L (C P P)], [B N]
 
 
+def to_teacher_rgb(platform, cube, metadata):
+    """Read RGB bands from the sensor to feed the teacher model"""
+    if platform == "sentinel-1-rtc":
+        r = cube[:, 0, :, :]
+        g = cube[:, 1, :, :]
+        b = r - g
+        return torch.stack((r, g, b), dim=1)
+    indices = metadata[platform].rgb_indices
+    return cube[:, indices, :, :]
+
+
 class ClayMAE(nn.Module):
     def __init__(  # noqa: PLR0913
         self,
@@ -376,6 +522,10 @@ class ClayMAE(nn.Module):
         decoder_heads,
         decoder_dim_head,
         decoder_mlp_ratio,
+        attention_backend="auto",
+        checkpoint_layers=None,
+        cache_kernels=False,
+        teacher_features=False,
         **kwargs,
     ):
         super().__init__()
@@ -384,12 +534,29 @@ class ClayMAE(nn.Module):
         self.norm_pix_loss = norm_pix_loss
         self.shuffle = shuffle
         self.metadata = metadata
-        self.teacher = timm.create_model(teacher, pretrained=True, num_classes=0)
-        self.teacher_chip_size = 224
+        # Wavelengths & gsd per platform, created once instead of every step
+        self.waves = {
+            platform: torch.tensor(list(meta.bands.wavelength.values()))
+            for platform, meta in metadata.items()
+        }
+        self.gsd = {
+            platform: torch.tensor(float(meta.gsd))
+            for platform, meta in metadata.items()
+        }
+        # Transformer blocks to recompute in backward, per encoder & decoder
+        checkpoint_layers = checkpoint_layers or {}
+        if teacher_features:  # Precomputed per chip, the teacher is not needed
+            with torch.device("meta"):  # Only to read the feature size
+                teacher_dim = timm.create_model(teacher, num_classes=0).num_features
+            self.teacher = None
+        else:
+            self.teacher = timm.create_model(teacher, pretrained=True, num_classes=0)
+            teacher_dim = self.teacher.num_features
+        self.teacher_chip_size = TEACHER_CHIP_SIZE
         self.teacher_resize = v2.Resize(
             size=(self.teacher_chip_size, self.teacher_chip_size)
         )
-        self.proj = nn.Linear(dim, self.teacher.num_features)
+        self.proj = nn.Linear(dim, teacher_dim)
 
         self.encoder = Encoder(
             mask_ratio=mask_ratio,
@@ -400,6 +567,9 @@ class ClayMAE(nn.Module):
             heads=heads,
             dim_head=dim_head,
             mlp_ratio=mlp_ratio,
+            attention_backend=attention_backend,
+            checkpoint_layers=checkpoint_layers.get("encoder"),
+            cache_kernels=cache_kernels,
         )
 
         self.decoder = Decoder(
@@ -411,19 +581,33 @@ class ClayMAE(nn.Module):
             heads=decoder_heads,
             dim_head=decoder_dim_head,
             mlp_ratio=decoder_mlp_ratio,
+            attention_backend=attention_backend,
+            checkpoint_layers=checkpoint_layers.get("decoder"),
+            cache_kernels=cache_kernels,
         )
 
         self.freeze_teacher()
 
     def freeze_teacher(self):
+        if self.teacher is None:
+            return
         for param in self.teacher.parameters():
             param.requires_grad = False
 
-    def per_pixel_loss(self, cube, pixels, masked_matrix):
+    def compile_modules(self):
+        """
+        Compile the encoder, decoder & reconstruction loss with dynamic shapes,
+        so that chip size changes don't trigger recompiles. The forward itself
+        stays eager, it groups the batch by platform & runs the frozen teacher.
+        """
+        self.encoder.forward = torch.compile(self.encoder.forward, dynamic=True)
+        self.decoder.forward = torch.compile(self.decoder.forward, dynamic=True)
+        self.per_pixel_loss = torch.compile(self.per_pixel_loss, dynamic=True)
+
+    def per_patch_loss(self, cube, pixels):
         """
         cube: [B C H W]
         pixels: [B L (C P P)]
-        masked_matrix: [B L], 0 is unmasked, 1 is masked
         """
         patches = rearrange(
             cube,
@@ -438,7 +622,20 @@ class ClayMAE(nn.Module):
             patches = (patches - mean) / (var + 1e-6) ** 0.5
 
         loss = F.l1_loss(patches, pixels, reduction="none")  # loss per pixel
-        loss = reduce(loss, "B L D -> B L", reduction="mean")  # loss per patch
+        return reduce(loss, "B L D -> B L", reduction="mean")  # loss per patch
+
+    def per_pixel_loss(self, cube, pixels, masked_matrix):
+        """
+        cube: [B C H W] or list of [B' C' H W] per platform
+        pixels: [B L (C P P)] or list of [B' L (C' P P)] per platform
+        masked_matrix: [B L], boolean, True is masked
+        """
+        if isinstance(cube, (list, tuple)):
+            loss = torch.cat(
+                [self.per_patch_loss(c, p) for c, p in zip(cube, pixels)], dim=0
+            )  # [B L]
+        else:
+            loss = self.per_patch_loss(cube, pixels)  # [B L]
 
         loss = (
             loss * masked_matrix
@@ -449,15 +646,34 @@ class ClayMAE(nn.Module):
     def forward(self, datacube):
         """
         datacube: dict containing the following keys:
-            - pixels: [B C H W]
+            - pixels: [B C H W], or for batches mixing platforms a list of
+              [B' C' H W] with one entry per platform
             - time: [B 4] # week hour
             - latlon: [B 4] # lat lon
-            - platform: [B 1]
+            - platform: [B], samples of a platform are contiguous
             - date: [B 1]
         """
-        platform = datacube["platform"][0]
-        waves = torch.tensor(list(self.metadata[platform].bands.wavelength.values()))
-        gsd = torch.tensor(self.metadata[platform].gsd)
+        platforms = [
+            platform for platform, _ in itertools.groupby(datacube["platform"])
+        ]
+        cube_groups = datacube["pixels"]
+        if isinstance(cube_groups, torch.Tensor):
+            cube_groups = [cube_groups]
+        assert len(cube_groups) == len(platforms), "Expected pixels per platform"
+
+        cubes = cube_groups
+        waves = [self.waves[platform] for platform in platforms]
+        group_sizes = [len(cube) for cube in cube_groups]
+        if len(platforms) == 1:  # Single platform, keep the plain tensor layout
+            cubes, waves, group_sizes = cube_groups[0], waves[0], None
+            gsd = self.gsd[platforms[0]]
+        else:
+            gsd = torch.cat(
+                [
+                    self.gsd[platform].expand(size)
+                    for platform, size in zip(platforms, group_sizes)
+                ]
+            )  # [B]
 
         # ENCODER
         (
@@ -467,7 +683,7 @@ class ClayMAE(nn.Module):
             masked_matrix,  # [B L]
         ) = self.encoder(
             {
-                "pixels": datacube["pixels"],
+                "pixels": cubes,
                 "time": datacube["time"],
                 "latlon": datacube["latlon"],
                 "gsd": gsd,
@@ -485,27 +701,28 @@ class ClayMAE(nn.Module):
             datacube["latlon"],
             gsd,
             waves,
+            group_sizes,
         )  # [B L (C P P)]
 
         # LOSS
-        reconstruction_loss = self.per_pixel_loss(
-            datacube["pixels"], pixels, masked_matrix
-        )
+        reconstruction_loss = self.per_pixel_loss(cubes, pixels, masked_matrix)
 
         # TEACHER
         encoder_output = self.proj(encoded_unmasked_patches[:, 0, :])  # [B D']
-        with torch.no_grad():
-            if platform == "sentinel-1-rtc":
-                r = datacube["pixels"][:, 0, :, :]
-                g = datacube["pixels"][:, 1, :, :]
-                b = r - g
-                rgb = torch.stack((r, g, b), dim=1)
-            else:
-                # Read RGB bands from the sensor to feed the teacher model
-                indices = self.metadata[platform].rgb_indices
-                rgb = datacube["pixels"][:, indices, :, :]
-            rgb = self.teacher_resize(rgb)
-            teacher_output = self.teacher(rgb)
+        if "teacher_features" in datacube:  # Precomputed, [B D']
+            teacher_output = datacube["teacher_features"]
+        else:
+            assert self.teacher is not None, "Expected teacher_features in the batch"
+            with torch.no_grad():
+                rgb = torch.cat(
+                    [
+                        to_teacher_rgb(platform, cube, self.metadata)
+                        for platform, cube in zip(platforms, cube_groups)
+                    ],
+                    dim=0,
+                )  # [B 3 H W]
+                rgb = self.teacher_resize(rgb)
+                teacher_output = self.teacher(rgb)
 
         representation_loss = -(
             F.cosine_similarity(encoder_output, teacher_output).mean()
@@ -607,10 +824,20 @@ class ClayMAEModule(L.LightningModule):
         b1=0.9,
         b2=0.95,
         embeddings_level: Literal["mean", "patch", "group"] = "mean",
+        attention_backend: Literal["auto", "math", "efficient", "flash"] = "auto",
+        checkpoint_layers: dict[str, int | list[int]] | None = None,
+        cache_kernels: bool = False,
+        compile: bool = False,
+        teacher_features: bool = False,
     ):
         super().__init__()
         self.save_hyperparameters(logger=True)
         self.metadata = Box(yaml.safe_load(open(metadata_path)))
+        if attention_backend not in ATTENTION_BACKENDS:
+            raise ValueError(
+                f"Invalid attention backend {attention_backend}. "
+                f"Expected one of {ATTENTION_BACKENDS}"
+            )
         model_map = {
             "tiny": clay_mae_tiny,
             "small": clay_mae_small,
@@ -625,15 +852,22 @@ class ClayMAEModule(L.LightningModule):
                 "shuffle": shuffle,
                 "metadata": self.metadata,
                 "teacher": teacher,
+                "attention_backend": attention_backend,
+                "checkpoint_layers": checkpoint_layers,
+                "cache_kernels": cache_kernels,
+                "teacher_features": teacher_features,
             }
             self.model = model_map[model_size](**model_args)
+            if compile:
+                self.model.compile_modules()
         else:
             raise ValueError(
                 f"Invalid model size {model_size}. Expected one of {model_map.keys()}"
             )
 
     def on_train_epoch_start(self):
-        self.model.teacher.eval()
+        if self.model.teacher is not None:
+            self.model.teacher.eval()
 
     def forward(self, datacube: dict[str, torch.Tensor]):
         return self.model(datacube)
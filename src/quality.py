@@ -0,0 +1,77 @@
+"""
+Quality index of the chips of a ChipManifest, stored as extra columns of the
+manifest, so that ClayDataModule skips poor chips without reading them, with
+`data.chip_filters`.
+
+Every chip file gets, over all its chips & bands:
+
+- `nodata_fraction`, the fraction of pixels equal to a nodata value or not
+  finite, e.g. the `0` & `-9999` fill of Sentinel-1 chips.
+- `saturated_fraction`, the fraction of valid pixels at or above the
+  saturation value of the platform, e.g. clouds over Sentinel-2 chips.
+- `variance`, the mean over bands of the variance of the valid pixels of a
+  strided subsample, close to 0 for flat fill or featureless chips.
+
+Compute them with `scripts/compute_chip_quality.py`.
+"""
+
+from multiprocessing import Pool
+
+import numpy as np
+
+QUALITY_COLUMNS = ("nodata_fraction", "saturated_fraction", "variance")
+
+
+def chip_quality(chip_path, nodata, saturation=None, stride=4):
+    """Quality of a chip file, in the order of QUALITY_COLUMNS"""
+    with np.load(chip_path, allow_pickle=False) as chip:
+        pixels = chip["pixels"]  # [b2 C H W]
+    valid = np.isfinite(pixels)
+    if nodata:
+        valid &= ~np.isin(pixels, nodata)
+    num_valid = valid.sum()
+
+    saturated_fraction = 0.0
+    if saturation is not None and num_valid:
+        saturated_fraction = (valid & (pixels >= saturation)).sum() / num_valid
+
+    # Per band variance of the valid pixels of every `stride` rows & columns
+    sub = pixels[..., ::stride, ::stride].swapaxes(0, 1).astype(np.float64)
+    sub = sub.reshape(len(sub), -1)  # [C N]
+    mask = valid[..., ::stride, ::stride].swapaxes(0, 1).reshape(len(sub), -1)
+    count = mask.sum(axis=1)
+    mean = np.where(mask, sub, 0).sum(axis=1) / np.maximum(count, 1)
+    deviations = np.where(mask, sub - mean[:, None], 0)
+    band_variance = np.square(deviations).sum(axis=1) / np.maximum(count, 1)
+    variance = band_variance[count > 0].mean() if count.any() else 0.0
+
+    return 1 - num_valid / valid.size, saturated_fraction, variance
+
+
+def quality_job(job):
+    chips_path, nodata, saturation = job
+    return [
+        chip_quality(chip_path, nodata, saturation.get(chip_path.parent.name))
+        for chip_path in chips_path
+    ]
+
+
+def compute_quality(  # noqa: PLR0913
+    manifest, rows, nodata=(), saturation=None, workers=8, chunk_size=256
+):
+    """
+    QUALITY_COLUMNS of the `rows` of a ChipManifest, in parallel, with the
+    `saturation` value of every platform, if any
+    """
+    jobs = (
+        (
+            [manifest[i] for i in rows[start : start + chunk_size]],
+            list(nodata),
+            saturation or {},
+        )
+        for start in range(0, len(rows), chunk_size)
+    )
+    with Pool(workers) as pool:
+        values = [value for chunk in pool.imap(quality_job, jobs) for value in chunk]
+    values = np.array(values, dtype=np.float32).reshape(-1, len(QUALITY_COLUMNS))
+    return dict(zip(QUALITY_COLUMNS, values.T))
@@ -0,0 +1,116 @@
+"""
+Node-local disk cache of the chips of an S3 data directory.
+
+Objects are downloaded with concurrent range requests into `cache_dir`, under
+their bucket & key, and read from there while they stay hot. The cache is
+shared by all the processes of a node, the main process prefetching ahead of
+the sampler & the dataloader workers reading. Files are evicted least recently
+used first once the cache grows past `max_bytes`.
+"""
+
+import contextlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import s3fs
+
+
+class S3ChipCache:
+    def __init__(  # noqa: PLR0913
+        self,
+        cache_dir: str,
+        max_bytes: int,
+        storage_options: dict | None = None,
+        part_size: int = 8 * 1024**2,
+        max_concurrency: int = 16,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.storage_options = storage_options or {}
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.cached_bytes = None  # estimate, since the last eviction scan
+        self.lock = threading.Lock()
+        self._fs = self._pool = self._pid = None
+
+    def __getstate__(self):
+        # The filesystem, threads & lock are recreated in every process
+        state = {**self.__dict__, "_fs": None, "_pool": None, "_pid": None}
+        state.pop("lock")
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, lock=threading.Lock())
+
+    def connect(self):
+        """Create the filesystem & threads once in every (forked) process"""
+        if self._pid != os.getpid():
+            self._fs = s3fs.S3FileSystem(
+                skip_instance_cache=True, **self.storage_options
+            )
+            self._pool = ThreadPoolExecutor(self.max_concurrency)
+            self._pid = os.getpid()
+
+    @property
+    def fs(self):
+        self.connect()
+        return self._fs
+
+    @property
+    def pool(self):
+        self.connect()
+        return self._pool
+
+    def fetch(self, key):
+        """Bytes of the object at `bucket/key`, read through the cache"""
+        path = self.cache_dir / key
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return self.download(key)
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)  # mark as recently used
+        return data
+
+    def prefetch(self, keys):
+        """Download the objects missing from the cache in the background"""
+        for key in keys:
+            if not (self.cache_dir / key).exists():
+                self.pool.submit(self.download, key)
+
+    def download(self, key):
+        size = self.fs.size(key)
+        starts = list(range(0, size, self.part_size)) or [0]
+        ends = [min(start + self.part_size, size) for start in starts]
+        data = b"".join(self.fs.cat_ranges([key] * len(starts), starts, ends))
+
+        # Write to a temporary file first, so readers never see partial files
+        path = self.cache_dir / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+        with self.lock:
+            if self.cached_bytes is None or self.cached_bytes + size > self.max_bytes:
+                self.evict()  # rescan, other processes write to the cache too
+            else:
+                self.cached_bytes += size
+        return data
+
+    def evict(self):
+        """Delete the least recently used files down to 90% of `max_bytes`"""
+        files = []
+        for path in self.cache_dir.rglob("*"):
+            with contextlib.suppress(FileNotFoundError):
+                if path.is_file() and not path.name.startswith("."):
+                    stat = path.stat()
+                    files.append((stat.st_mtime, stat.st_size, path))
+        self.cached_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if self.cached_bytes <= 0.9 * self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self.cached_bytes -= size
@@ -0,0 +1,167 @@
+"""
+Transformer with fused attention, weight compatible with
+https://github.com/lucidrains/vit-pytorch/blob/main/vit_pytorch/simple_vit.py
+
+Attention is routed through `torch.nn.functional.scaled_dot_product_attention`
+instead of materializing the full softmax matrix.
+"""
+
+import contextlib
+
+import torch
+import torch.nn.functional as F
+from einops import rearrange
+from torch import nn
+from torch.utils.checkpoint import checkpoint
+
+try:
+    from torch.nn.attention import SDPBackend, sdpa_kernel
+except ImportError:  # torch < 2.3
+    SDPBackend = sdpa_kernel = None
+    from torch.backends.cuda import sdp_kernel
+
+ATTENTION_BACKENDS = ("auto", "math", "efficient", "flash")
+
+
+def attention_backend_context(backend):
+    """
+    Restrict scaled dot product attention to a backend. `efficient` & `flash`
+    fall back to the slower kernels when they are not available for the
+    device, dtype or shape.
+    """
+    assert backend in ATTENTION_BACKENDS, f"Expected one of {ATTENTION_BACKENDS}"
+    if backend == "auto":  # Let torch pick the kernel
+        return contextlib.nullcontext()
+
+    enable_flash = backend == "flash"
+    enable_mem_efficient = backend in ("efficient", "flash")
+    if sdpa_kernel is None:
+        return sdp_kernel(
+            enable_flash=enable_flash,
+            enable_math=True,
+            enable_mem_efficient=enable_mem_efficient,
+        )
+
+    backends = [SDPBackend.MATH]
+    if enable_mem_efficient:
+        backends.insert(0, SDPBackend.EFFICIENT_ATTENTION)
+    if enable_flash:
+        backends.insert(0, SDPBackend.FLASH_ATTENTION)
+    return sdpa_kernel(backends)
+
+
+def resolve_checkpoint_layers(checkpoint_layers, depth):
+    """
+    Indices of the transformer blocks to recompute in the backward pass.
+
+    `checkpoint_layers` is either None for no checkpointing, an int stride to
+    checkpoint every n-th block (1 checkpoints all blocks), or a list of block
+    indices.
+    """
+    if not checkpoint_layers:
+        return set()
+    if isinstance(checkpoint_layers, int):
+        return set(range(0, depth, checkpoint_layers))
+    assert all(
+        0 <= idx < depth for idx in checkpoint_layers
+    ), f"Checkpoint layers must be within the {depth} transformer blocks"
+    return set(checkpoint_layers)
+
+
+class FeedForward(nn.Module):
+    def __init__(self, dim, hidden_dim):
+        super().__init__()
+        self.net = nn.Sequential(
+            nn.LayerNorm(dim),
+            nn.Linear(dim, hidden_dim),
+            nn.GELU(),
+            nn.Linear(hidden_dim, dim),
+        )
+
+    def forward(self, x):
+        return self.net(x)
+
+
+class Attention(nn.Module):
+    def __init__(self, dim, heads=8, dim_head=64, backend="auto"):
+        super().__init__()
+        inner_dim = dim_head * heads
+        self.heads = heads
+        self.backend = backend
+        self.norm = nn.LayerNorm(dim)
+
+        self.to_qkv = nn.Linear(dim, inner_dim * 3, bias=False)
+        self.to_out = nn.Linear(inner_dim, dim, bias=False)
+
+    def forward(self, x):
+        x = self.norm(x)
+
+        qkv = self.to_qkv(x).chunk(3, dim=-1)
+        q, k, v = (rearrange(t, "b n (h d) -> b h n d", h=self.heads) for t in qkv)
+
+        # Scaled by dim_head ** -0.5 by default, same as simple_vit
+        with attention_backend_context(self.backend):
+            out = F.scaled_dot_product_attention(q, k, v)
+
+        out = rearrange(out, "b h n d -> b n (h d)")
+        return self.to_out(out)
+
+
+class TransformerBlock(nn.ModuleList):
+    """
+    Attention & feedforward with residual connections. Kept as a ModuleList of
+    [attention, feedforward] so the state_dict keys match simple_vit, while
+    being a single callable unit, e.g. for FSDP wrapping.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self, dim, heads, dim_head, mlp_dim, attention_backend="auto"
+    ):
+        super().__init__(
+            [
+                Attention(
+                    dim, heads=heads, dim_head=dim_head, backend=attention_backend
+                ),
+                FeedForward(dim, mlp_dim),
+            ]
+        )
+
+    def forward(self, x):
+        attn, ff = self
+        x = attn(x) + x
+        x = ff(x) + x
+        return x
+
+
+class Transformer(nn.Module):
+    def __init__(  # noqa: PLR0913
+        self,
+        dim,
+        depth,
+        heads,
+        dim_head,
+        mlp_dim,
+        attention_backend="auto",
+        checkpoint_layers=None,
+    ):
+        super().__init__()
+        self.checkpoint_layers = resolve_checkpoint_layers(checkpoint_layers, depth)
+        self.norm = nn.LayerNorm(dim)
+        self.layers = nn.ModuleList(
+            [
+                TransformerBlock(dim, heads, dim_head, mlp_dim, attention_backend)
+                for _ in range(depth)
+            ]
+        )
+
+    def forward_layer(self, idx, x):
+        """Run a single transformer block, recomputed in backward if selected"""
+        block = self.layers[idx]
+        if idx in self.checkpoint_layers and torch.is_grad_enabled():
+            return checkpoint(block, x, use_reentrant=False)
+        return block(x)
+
+    def forward(self, x):
+        for idx in range(len(self.layers)):
+            x = self.forward_layer(idx, x)
+        return self.norm(x)
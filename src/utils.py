@@ -3,6 +3,8 @@ Code from https://github.com/lucidrains/vit-pytorch/blob/main/vit_pytorch/simple
 
 """
 
+import functools
+
 import torch
 
 
@@ -21,18 +23,39 @@ def posemb_sincos_2d(h, w, dim, temperature: int = 10000, dtype=torch.float32):
 def posemb_sincos_2d_with_gsd(
     h, w, dim, gsd=1.0, temperature: int = 10000, dtype=torch.float32
 ):
+    """
+    Returns a [L D] encoding for a scalar gsd, or a [B L D] encoding when gsd
+    is a tensor of shape [B] holding one gsd per sample.
+    """
     y, x = torch.meshgrid(torch.arange(h), torch.arange(w), indexing="ij")
     assert (dim % 4) == 0, "feature dimension must be multiple of 4 for sincos emb"
 
+    gsd = torch.as_tensor(gsd, dtype=torch.float32)[..., None]  # [... 1]
     omega = torch.arange(dim // 4) / (dim // 4 - 1)
     omega = 1.0 / (temperature ** (2 * omega / dim)) * (gsd / 1.0)  # Adjusted for g
 
-    y = y.flatten()[:, None] * omega[None, :]
-    x = x.flatten()[:, None] * omega[None, :]
-    pe = torch.cat((x.sin(), x.cos(), y.sin(), y.cos()), dim=1)
+    y = y.flatten()[:, None] * omega[..., None, :]
+    x = x.flatten()[:, None] * omega[..., None, :]
+    pe = torch.cat((x.sin(), x.cos(), y.sin(), y.cos()), dim=-1)
     return pe.type(dtype)
 
 
+@functools.lru_cache(maxsize=64)
+def cached_posemb_sincos_2d_with_gsd(  # noqa: PLR0913
+    h, w, dim, gsd, dtype, device, pad=0
+):
+    """
+    Memoized `posemb_sincos_2d_with_gsd` for a scalar gsd, kept on the device,
+    zero padded with `pad` trailing channels. The table is shared, callers
+    must not modify it in place.
+
+    The cache is bounded to the 64 most recently used tables, call
+    `cached_posemb_sincos_2d_with_gsd.cache_clear()` to release them.
+    """
+    pe = posemb_sincos_2d_with_gsd(h, w, dim, gsd=gsd, dtype=dtype).to(device)
+    return torch.nn.functional.pad(pe, (0, pad))  # [(h w) (dim + pad)]
+
+
 def posemb_sincos_1d(pos, dim, temperature: int = 10000, dtype=torch.float32):
     assert (
         dim % 2 == 0